@@ -0,0 +1,65 @@
+# Online detection while recording: runs one of the log_viewer filters (see log_viewer/stream_filters.py) on the
+# RSSI values of every device and logs when its output rises above or falls below a threshold.
+#
+# Detections are written as "<timestamp>\t<address>\t<start|end>\t<filter output>" lines to events.log in the
+# output directory. The file is flushed after every line, so it can be followed while recording.
+
+import os
+import sys
+import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "log_viewer"))
+import stream_filters
+
+import rssi_binary
+
+EVENTS_FILE = "events.log"
+
+
+class Detector(object):
+    """
+    Runs a stream filter per device on AdvertisingReports.
+    """
+    def __init__(self, directory, filter_name, data="", threshold=0.0):
+        """
+        :param directory: output directory
+        :param filter_name: name of a filter in stream_filters.stream_filter_table
+        :param data: filter input, as in log_viewer
+        :param threshold: a detection starts when the filter output is larger than this value
+        """
+        if filter_name not in stream_filters.stream_filter_table:
+            raise ValueError("Unknown filter '{}'.".format(filter_name))
+        self.filter_class = stream_filters.stream_filter_table[filter_name]
+        self.data = data
+        self.threshold = threshold
+        self.filters = {}
+        self.detected = set()
+        self.file = open(os.path.join(directory, EVENTS_FILE), 'a')
+
+    def handle(self, report):
+        address = rssi_binary.address_to_string(report.address)
+        stream = self.filters.get(address)
+        if stream is None:
+            stream = self.filters[address] = self.filter_class(self.data)
+        for output_time, value in stream.update(datetime.datetime.fromtimestamp(report.time), report.rssi):
+            self.detect(address, output_time, value)
+
+    def detect(self, address, output_time, value):
+        detected = value > self.threshold
+        if detected == (address in self.detected):
+            return
+        if detected:
+            self.detected.add(address)
+        else:
+            self.detected.remove(address)
+        line = "{}\t{}\t{}\t{}".format(output_time, address, "start" if detected else "end", value)
+        print "Detection: " + line.replace("\t", " ")
+        self.file.write(line + "\n")
+        self.file.flush()
+
+    def close(self):
+        # Handle the outputs that are still waiting for their window to complete
+        for address, stream in self.filters.iteritems():
+            for output_time, value in stream.flush():
+                self.detect(address, output_time, value)
+        self.file.close()
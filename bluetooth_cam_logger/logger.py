@@ -11,11 +11,13 @@
 import os
 import sys
 
+import time
 import datetime
 from time import strftime
 
 import blescan
-import bluetooth._bluetooth as bluez
+import pipeline
+import rssi_writer
 
 import pygame
 import pygame.camera
@@ -25,11 +27,30 @@ devices_file = "devices.list"
 
 output_directory = strftime("log-%Y-%m-%d/")
 
-bluetooth_device = 0
+bluetooth_devices = [0] # Adapter numbers, or fake socket specifications such as "fake:rate=100" (see fakehci.py)
+bluetooth_timeout = 0.1 # Maximum time (s) spent waiting for adverts before the camera is serviced
 
-camera_device = "/dev/video0"
+camera_device = "/dev/video0" # "fake" for generated images (see fakehci.FakeCamera)
 camera_resolution = (320,240)
 
+rssi_queue_size = 1000 # Adverts waiting to be written
+reorder_delay = 0.5 # With several adapters, adverts are held back this long (s) to write them in time order...
+reorder_size = 10000 # ...but at most this many, adverts that arrive later than that are dropped
+image_queue_size = 5 # Images waiting to be encoded
+image_workers = 1 # Number of JPEG encoder threads
+status_interval = 60.0 # Seconds between queue status reports
+
+rssi_batch_size = 100 # Write RSSI values in batches of this size...
+rssi_flush_interval = 5.0 # ...or at least every this many seconds
+rssi_fsync = rssi_writer.FSYNC_ROTATE # When to force RSSI data to disk: FSYNC_NEVER, FSYNC_ROTATE or FSYNC_FLUSH
+rssi_echo_every = 10 # Print every n'th RSSI value, 0 to disable
+rssi_binary_format = True # Write compact binary .rssib files instead of .rssi text
+
+live_filter = None # Filter from log_viewer/filters.py to run on every device while recording, e.g. "windowed_minimum"
+live_filter_data = "" # Filter input, e.g. "60,5"
+live_filter_threshold = 0.0 # Detections are logged to events.log when the filter output is larger than this
+detector_queue_size = 1000 # Adverts waiting for the detector
+
 # Process command line arguments	
 if len(sys.argv) >= 2:
 	devices_file = sys.argv[1]
@@ -38,25 +59,35 @@ if os.path.isdir(output_directory):
 	print "Error: output directory '{}' already exists.".format(output_directory)
 	sys.exit(1)
 
-# Prepare Bluetooth
-try:
-	sock = bluez.hci_open_dev(bluetooth_device)
-except:
-	print "Error accessing bluetooth device id '{}'.".format(bluetooth_device)
-	sys.exit(1)
-blescan.hci_le_set_scan_parameters(sock)
-blescan.hci_enable_le_scan(sock)
+# Prepare Bluetooth, adverts are tagged with the index of the adapter in bluetooth_devices
+sockets = []
+scanners = []
+for adapter, bluetooth_device in enumerate(bluetooth_devices):
+	try:
+		sock = blescan.open_socket(bluetooth_device)
+	except:
+		print "Error accessing bluetooth device id '{}'.".format(bluetooth_device)
+		sys.exit(1)
+	blescan.hci_le_set_scan_parameters(sock)
+	blescan.hci_enable_le_scan(sock)
+	sockets.append(sock)
+	scanners.append(blescan.Scanner(sock, adapter))
 
 print "Reading devices from {}...".format(devices_file)
 with open(devices_file) as f:
 	devices_list = f.read().lower().splitlines()
 for device in devices_list:
 	print device
+devices = set(blescan.get_packed_bdaddr(device) for device in devices_list if device)
 
 # Prepare camera
 pygame.init()
 pygame.camera.init()
-cam = pygame.camera.Camera(camera_device, camera_resolution)
+if camera_device == "fake":
+	import fakehci
+	cam = fakehci.FakeCamera(camera_resolution)
+else:
+	cam = pygame.camera.Camera(camera_device, camera_resolution)
 cam.start()
 #screen = pygame.display.set_mode(camera_resolution)
 #pygame.display.set_caption("Recording RSSI and webcam images...")
@@ -66,41 +97,97 @@ os.mkdir(output_directory)
 print "Logging to '{}'.".format(output_directory)
 
 # Prepare for recording
-rssi_file = open(os.path.join(output_directory, strftime("%Y%m%d-%H.rssi")), 'w')
-rssi_last_time = datetime.datetime.now()
-
+writer = rssi_writer.RssiWriter(output_directory, batch_size=rssi_batch_size, flush_interval=rssi_flush_interval,
+                                fsync=rssi_fsync, echo_every=rssi_echo_every, binary=rssi_binary_format,
+                                adapter_column=len(bluetooth_devices) > 1)
 camera_last_time = datetime.datetime.now()
 
+rssi_queue = pipeline.DropQueue("rssi", rssi_queue_size)
+image_queue = pipeline.DropQueue("images", image_queue_size)
+queues = [rssi_queue, image_queue]
+
+if live_filter:
+	import detector
+	print "Running filter '{}' ({}) for live detection.".format(live_filter, live_filter_data)
+	live_detector = detector.Detector(output_directory, live_filter, live_filter_data, live_filter_threshold)
+	detector_queue = pipeline.DropQueue("detector", detector_queue_size)
+	queues.append(detector_queue)
+
+# The scanners of several adapters run in parallel, merge their adverts in time order before they are written and
+# passed to the detector (the filters need samples in time order)
+write_rssi, poll_rssi, close_rssi = writer.write, writer.poll, writer.close
+reordering = len(bluetooth_devices) > 1
+if reordering:
+	def write_ordered(report):
+		writer.write(report)
+		if live_filter:
+			detector_queue.offer(report)
+	reorder = pipeline.ReorderBuffer("reorder", write_ordered, reorder_delay, reorder_size)
+	queues.append(reorder)
+	def poll_rssi():
+		reorder.poll()
+		writer.poll()
+	def close_rssi():
+		reorder.flush()
+		writer.close()
+	write_rssi = reorder.push
+
+# Producers: read adverts and camera images as fast as possible, never wait for the disk
+def scan_bluetooth(scanner):
+	for report in scanner.reports(timeout=bluetooth_timeout):
+		if report.address in devices:
+			rssi_queue.offer(report)
+			if live_filter and not reordering:
+				detector_queue.offer(report)
+
+def grab_image():
+	global camera_last_time
+	# Record a camera image each second
+	image = cam.get_image()
+	current_time = datetime.datetime.now()
+	if current_time.second != camera_last_time.second:
+		camera_last_time = current_time
+		image_queue.offer((current_time, image))
+
+# Consumers: write RSSI values and encode images
+def save_image(item):
+	image_time, image = item
+	pygame.image.save(image, os.path.join(output_directory, image_time.strftime("%Y%m%d-%H.%M.%S.jpg")))
+
+producers = [pipeline.Worker("bluetooth {}".format(adapter), lambda scanner=scanner: scan_bluetooth(scanner))
+             for adapter, scanner in enumerate(scanners)]
+producers.append(pipeline.Worker("camera", grab_image))
+consumers = [pipeline.QueueWorker("rssi writer", rssi_queue, write_rssi, cleanup=close_rssi, idle=poll_rssi)]
+consumers += [pipeline.QueueWorker("image encoder {}".format(k), image_queue, save_image) for k in xrange(image_workers)]
+if live_filter:
+	consumers.append(pipeline.QueueWorker("detector", detector_queue, live_detector.handle, cleanup=live_detector.close))
+
 # Record
 running = True
 try:
+	for worker in consumers + producers:
+		worker.start()
+	status_last_time = time.time()
 	while running:
-		# Get the current time
-		current_time = datetime.datetime.now()
-		# Record RSSI
-		if current_time.hour != rssi_last_time.hour:
-			rssi_last_time = current_time
-			# Open a new file for logging
-			rssi_file.close()
-			rssi_file = open(os.path.join(output_directory, strftime("%Y%m%d-%H.rssi")), 'w')
-		adv_list = blescan.parse_events(sock,10)
-		for adv in adv_list:
-			data = adv.split(',')
-			if data[0] in devices_list:
-				rssi_line = "{}\t{}\t{}\n".format(current_time, data[0], data[5])
-				print rssi_line
-				rssi_file.write(rssi_line)
-		# Record a camera image each second
-		image = cam.get_image()
-		if current_time.second != camera_last_time.second:
-			camera_last_time = current_time
-			#screen.blit(image, (0,0))
-			#pygame.display.flip()
-			pygame.image.save(image, os.path.join(output_directory, strftime("%Y%m%d-%H.%M.%S.jpg")))
+		time.sleep(0.1)
 		# Quit if the main window is closed
 		for event in pygame.event.get():
 			if event.type == pygame.QUIT:
 				running = False
+		# Quit if one of the workers failed
+		for worker in consumers + producers:
+			if not worker.is_alive():
+				print "Error: {} thread stopped.".format(worker.name)
+				running = False
+		if time.time() - status_last_time >= status_interval:
+			status_last_time = time.time()
+			pipeline.print_status(queues)
 finally:
-	rssi_file.close()
+	# Stop the producers first so the consumers can handle all remaining items
+	for worker in producers + consumers:
+		worker.stop()
+	pipeline.print_status(queues)
+	for scanner, sock in zip(scanners, sockets):
+		scanner.close()
+		sock.close()
 	print "Done."
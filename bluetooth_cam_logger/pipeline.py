@@ -0,0 +1,168 @@
+# Helpers to run the logger as a set of threads connected by bounded queues.
+#
+# Producers (Bluetooth scanner, camera) offer items to a DropQueue, which never blocks: when a consumer
+# (file writer, JPEG encoder) falls behind, new items are dropped and counted instead of stalling the
+# producer. Each stage runs in a Worker thread. When several producers feed one consumer (e.g. one scanner per
+# Bluetooth adapter), a ReorderBuffer restores the time order of their items.
+
+import sys
+import time
+import heapq
+import threading
+import traceback
+import Queue
+
+
+class DropQueue(Queue.Queue):
+    """
+    Bounded queue that drops new items instead of blocking the producer when it is full.
+    """
+    def __init__(self, name, maxsize):
+        Queue.Queue.__init__(self, maxsize)
+        self.name = name
+        self.stats_lock = threading.Lock() # Several producers may offer items at the same time
+        self.offered = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def offer(self, item):
+        """
+        Add an item without blocking.
+        :return: False if the item was dropped because the queue is full
+        """
+        try:
+            self.put_nowait(item)
+        except Queue.Full:
+            with self.stats_lock:
+                self.offered += 1
+                self.dropped += 1
+            return False
+        depth = self.qsize()
+        with self.stats_lock:
+            self.offered += 1
+            self.max_depth = max(self.max_depth, depth)
+        return True
+
+    def status(self):
+        return "{}: depth {}/{} (max {}), dropped {}/{}".format(self.name, self.qsize(), self.maxsize,
+                                                               self.max_depth, self.dropped, self.offered)
+
+
+class Worker(threading.Thread):
+    """
+    Daemon thread that calls step() until stop() is called. Exceptions end the thread and are stored in
+    self.error, check is_alive() to detect failed workers.
+    """
+    def __init__(self, name, step, cleanup=None):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.step = step
+        self.cleanup = cleanup
+        self.stopping = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                self.step()
+            self.finish()
+        except Exception:
+            self.error = sys.exc_info()[1]
+            print "Error in {} thread:".format(self.name)
+            traceback.print_exc()
+        finally:
+            if self.cleanup:
+                self.cleanup()
+
+    def finish(self):
+        # Called in the thread after stop() was requested, before cleanup
+        pass
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.join(timeout)
+
+
+class QueueWorker(Worker):
+    """
+    Worker that passes the items of a queue to handle(item). Remaining items are handled before the thread
+    stops, so nothing that was accepted by the queue is lost on shutdown. idle() is called when no item
+    arrived within poll_interval seconds.
+    """
+    def __init__(self, name, queue, handle, cleanup=None, idle=None, poll_interval=0.1):
+        Worker.__init__(self, name, self.handle_next, cleanup)
+        self.queue = queue
+        self.handle = handle
+        self.idle = idle
+        self.poll_interval = poll_interval
+
+    def handle_next(self):
+        try:
+            item = self.queue.get(timeout=self.poll_interval)
+        except Queue.Empty:
+            if self.idle:
+                self.idle()
+            return
+        self.handle(item)
+
+    def finish(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.handle(item)
+
+
+class ReorderBuffer(object):
+    """
+    Passes items to output(item) in the order of their time attribute. Items are held back until they are delay
+    seconds old, so items that arrive a little out of order (from different producers) are sorted. The buffer is
+    bounded: when it holds max_size items, the oldest item is passed on early. Items that arrive after a newer
+    item was passed on are dropped and counted as late, so the output is always in time order (the hourly log
+    files and the readers rely on that).
+    """
+    def __init__(self, name, output, delay=0.5, max_size=10000):
+        self.name = name
+        self.output = output
+        self.delay = delay
+        self.max_size = max_size
+        self.heap = []
+        self.count = 0 # Tie breaker, keeps items with equal times in arrival order
+        self.last_time = None
+        self.late = 0
+        self.max_depth = 0
+
+    def push(self, item):
+        if self.last_time is not None and item.time < self.last_time:
+            self.late += 1
+            return
+        heapq.heappush(self.heap, (item.time, self.count, item))
+        self.count += 1
+        while len(self.heap) > self.max_size:
+            self.release()
+        self.max_depth = max(self.max_depth, len(self.heap))
+        self.poll()
+
+    def poll(self):
+        # Pass on the items that are old enough, call this regularly when idle
+        deadline = time.time() - self.delay
+        while self.heap and self.heap[0][0] <= deadline:
+            self.release()
+
+    def flush(self):
+        while self.heap:
+            self.release()
+
+    def release(self):
+        item_time, unused, item = heapq.heappop(self.heap)
+        self.last_time = item_time
+        self.output(item)
+
+    def status(self):
+        return "{}: depth {}/{} (max {}), dropped late {}".format(self.name, len(self.heap), self.max_size, self.max_depth,
+                                                          self.late)
+
+
+def print_status(queues):
+    print "[{}] {}".format(time.strftime("%H:%M:%S"), "; ".join(queue.status() for queue in queues))
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+# replay_bench.py
+#
+# Measures the throughput of the logger pipeline (scanner, queue and RSSI writer, optionally the camera and
+# JPEG encoder) without hardware, by replaying synthetic or recorded HCI packets through a fake socket (see
+# fakehci.py). Reports the end-to-end reports/s, the CPU time per report of this process (the fake adapter runs
+# in a separate process) and the reports dropped in the socket and in the queue.
+#
+# Use --record to make a recording with a real adapter, and --replay to replay it.
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+
+import blescan
+import fakehci
+import pipeline
+import rssi_writer
+
+# Read command line arguments
+parser = argparse.ArgumentParser(description="Benchmark the logger pipeline with a fake Bluetooth adapter.")
+parser.add_argument("--rate", type=float, default=1000.0, help="packets per second")
+parser.add_argument("--duration", type=float, default=10.0, help="seconds of packets to replay (or record)")
+parser.add_argument("--burst", type=int, default=1, help="packets sent back-to-back")
+parser.add_argument("--reports", type=int, default=1, help="advertising reports per packet (at most 6)")
+parser.add_argument("--devices", type=int, default=5, help="number of advertising devices")
+parser.add_argument("--replay", default=None, help="replay this recording instead of synthetic packets")
+parser.add_argument("--speed", type=float, default=1.0, help="replay speed of the recording")
+parser.add_argument("--record", default=None, help="record the packets of a real adapter to this file and exit")
+parser.add_argument("--device", type=int, default=0, help="adapter number for --record")
+parser.add_argument("--queue-size", type=int, default=1000, help="RSSI queue size")
+parser.add_argument("--batch-size", type=int, default=100, help="RSSI writer batch size")
+parser.add_argument("--text", action="store_true", help="write .rssi text files instead of the binary format")
+parser.add_argument("--camera", action="store_true", help="also run a fake camera and the JPEG encoder")
+args = parser.parse_args()
+
+if args.record:
+    sock = blescan.open_socket(args.device)
+    blescan.hci_le_set_scan_parameters(sock)
+    blescan.hci_enable_le_scan(sock)
+    with open(args.record, 'wb') as f:
+        count = fakehci.record_packets(sock, f, args.duration)
+    blescan.hci_disable_le_scan(sock)
+    sock.close()
+    print "Recorded {} packets to '{}'.".format(count, args.record)
+    sys.exit(0)
+
+if args.replay:
+    schedule = fakehci.read_recording(open(args.replay, 'rb'), args.speed)
+else:
+    packets = fakehci.synthetic_packets(args.devices, args.reports, count=int(args.rate * args.duration), seed=1)
+    schedule = fakehci.paced(packets, args.rate, args.burst)
+sock = fakehci.FakeHciSocket(schedule)
+scanner = blescan.Scanner(sock)
+
+output_directory = tempfile.mkdtemp(prefix="replay-bench-")
+writer = rssi_writer.RssiWriter(output_directory, batch_size=args.batch_size, binary=not args.text)
+rssi_queue = pipeline.DropQueue("rssi", args.queue_size)
+queues = [rssi_queue]
+
+received = [0]
+def scan_bluetooth():
+    for report in scanner.reports(timeout=0.1):
+        received[0] += 1
+        rssi_queue.offer(report)
+
+producers = [pipeline.Worker("bluetooth", scan_bluetooth)]
+consumers = [pipeline.QueueWorker("rssi writer", rssi_queue, writer.write, cleanup=writer.close, idle=writer.poll)]
+
+if args.camera:
+    import pygame
+    camera = fakehci.FakeCamera((320, 240))
+    image_queue = pipeline.DropQueue("images", 5)
+    queues.append(image_queue)
+    def grab_image():
+        image_queue.offer((time.time(), camera.get_image()))
+    def save_image(item):
+        image_time, image = item
+        pygame.image.save(image, os.path.join(output_directory, "{:.3f}.jpg".format(image_time)))
+    producers.append(pipeline.Worker("camera", grab_image))
+    consumers.append(pipeline.QueueWorker("image encoder", image_queue, save_image))
+
+# Replay
+print "Replaying to '{}'...".format(output_directory)
+try:
+    for worker in consumers + producers:
+        worker.start()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    time_start = time.time()
+    blescan.hci_enable_le_scan(sock) # Starts the fake adapter
+    finish_time = None
+    while not sock.finished() or received[0] < sock.sent_reports.value:
+        time.sleep(0.05)
+        if finish_time is None and sock.finished():
+            finish_time = time.time()
+        if finish_time is not None and time.time() - finish_time > 10.0:
+            print "Warning: not all sent reports were received."
+            break
+        failed = [worker.name for worker in consumers + producers if not worker.is_alive()]
+        if failed:
+            print "Error: {} thread stopped.".format(failed[0])
+            break
+    for worker in producers + consumers:
+        worker.stop()
+    time_end = time.time()
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+finally:
+    scanner.close()
+    sock.close()
+    shutil.rmtree(output_directory, ignore_errors=True)
+
+# Results
+elapsed = time_end - time_start
+cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+sent = sock.sent_reports.value + sock.dropped_reports.value
+written = writer.records
+pipeline.print_status(queues)
+print "Reports sent:               {} in {} packets".format(sent, sock.sent_packets.value + sock.dropped_packets.value)
+print "Dropped in socket:          {} ({:.2%})".format(sock.dropped_reports.value, sock.dropped_reports.value / float(max(1, sent)))
+print "Dropped in queue:           {} ({:.2%})".format(rssi_queue.dropped, rssi_queue.dropped / float(max(1, sent)))
+print "Reports written:            {}".format(written)
+print "Throughput:                 {:.0f} reports/s over {:.2f} s".format(written / elapsed, elapsed)
+print "CPU time per report:        {:.1f} us ({:.0%} CPU)".format(1e6 * cpu / max(1, received[0]), cpu / elapsed)
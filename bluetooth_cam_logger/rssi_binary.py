@@ -0,0 +1,178 @@
+# Compact binary RSSI log format (.rssib), an alternative to the tab separated .rssi text files.
+#
+# A file starts with a header and contains any number of chunks, all values are little endian:
+#
+#   header:  "RSSB", uint16 version
+#   chunk:   "CHNK", uint32 records, uint16 new addresses, uint8 flags, uint8 reserved,
+#            int64 earliest time, int64 latest time (version 1: time of the first and the last record),
+#            6 bytes per new address (packed, as received over the air),
+#            int64[records] time, uint16[records] device, int8[records] rssi,
+#            int8[records] txpower (if flags & FLAG_TXPOWER),
+#            uint16[records] major, uint16[records] minor (if flags & FLAG_BEACON),
+#            uint8[records] adapter (if flags & FLAG_ADAPTER)
+#
+# Times are microseconds since 1970-01-01 00:00 in local time, i.e. the same naive wall clock times that
+# are stored in the text logs. The device column indexes the address table of the file, which grows with
+# the new addresses of every chunk. A header may be repeated in place of a chunk (e.g. when a file is
+# appended to), which resets the address table. Missing txpower/major/minor values are stored as 0. The adapter
+# column holds the number of the receiving adapter when the logger scans with several adapters.
+#
+# Readers skip chunks outside the requested time range using the earliest and latest times. Version 1 files
+# stored the first and last record times instead, which are not bounds when the records are out of order, so
+# their chunks are always read. Chunks with unknown flags are rejected, as their size is unknown.
+
+import struct
+import datetime
+
+import numpy
+
+EXTENSION = ".rssib"
+MAGIC = "RSSB"
+CHUNK_MAGIC = "CHNK"
+VERSION = 2
+VERSIONS = (1, 2) # Versions that can be read
+
+FLAG_TXPOWER = 0x01
+FLAG_BEACON = 0x02
+FLAG_ADAPTER = 0x04
+KNOWN_FLAGS = FLAG_TXPOWER | FLAG_BEACON | FLAG_ADAPTER
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+_header = struct.Struct("<4sH")
+_chunk_header = struct.Struct("<4sIHBBqq")
+
+
+def datetime_to_us(time):
+    delta = time - EPOCH
+    return (delta.days*86400 + delta.seconds)*1000000 + delta.microseconds
+
+
+def address_to_string(packed):
+    return ':'.join('%02x' % ord(c) for c in reversed(packed))
+
+
+def string_to_address(address):
+    return "".join(chr(int(b, 16)) for b in reversed(address.split(':')))
+
+
+class ChunkWriter(object):
+    """
+    Writes chunks of RSSI records to a binary log file object.
+    """
+    def __init__(self, f, flags=FLAG_TXPOWER|FLAG_BEACON):
+        self.file = f
+        self.flags = flags
+        self.addresses = {}
+        self.file.write(_header.pack(MAGIC, VERSION))
+
+    def write_chunk(self, times, addresses, rssi, txpower=None, major=None, minor=None, adapter=None):
+        """
+        :param times: time of each record in microseconds (see datetime_to_us)
+        :param addresses: packed address of each record
+        :param rssi: RSSI of each record
+        :param txpower, major, minor, adapter: optional columns, None values are stored as 0
+        """
+        n = len(times)
+        if n == 0:
+            return
+        devices = []
+        new_addresses = []
+        for address in addresses:
+            index = self.addresses.get(address)
+            if index is None:
+                index = self.addresses[address] = len(self.addresses)
+                new_addresses.append(address)
+            devices.append(index)
+        parts = [_chunk_header.pack(CHUNK_MAGIC, n, len(new_addresses), self.flags, 0, min(times), max(times))]
+        parts.extend(new_addresses)
+        parts.append(struct.pack("<%dq" % n, *times))
+        parts.append(struct.pack("<%dH" % n, *devices))
+        parts.append(struct.pack("<%db" % n, *rssi))
+        if self.flags & FLAG_TXPOWER:
+            parts.append(struct.pack("<%db" % n, *[value or 0 for value in txpower or [0]*n]))
+        if self.flags & FLAG_BEACON:
+            parts.append(struct.pack("<%dH" % n, *[value or 0 for value in major or [0]*n]))
+            parts.append(struct.pack("<%dH" % n, *[value or 0 for value in minor or [0]*n]))
+        if self.flags & FLAG_ADAPTER:
+            parts.append(struct.pack("<%dB" % n, *[value or 0 for value in adapter or [0]*n]))
+        self.file.write("".join(parts))
+
+
+class Chunk(object):
+    """
+    Chunk read from a binary log. Columns are numpy arrays, txpower/major/minor/adapter are None if the chunk
+    does not contain them. addresses is the address table (as strings) that device indexes into.
+    """
+    __slots__ = ("time", "device", "rssi", "txpower", "major", "minor", "adapter", "addresses")
+
+    def __init__(self, time, device, rssi, txpower, major, minor, adapter, addresses):
+        self.time = time
+        self.device = device
+        self.rssi = rssi
+        self.txpower = txpower
+        self.major = major
+        self.minor = minor
+        self.adapter = adapter
+        self.addresses = addresses
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of binary RSSI log.")
+    return data
+
+
+def read_chunks(f, start_time=None, end_time=None):
+    """
+    Read the chunks from a binary log file object (e.g. from zipfile.open()).
+    :param start_time: (datetime) skip chunks with only records before this time
+    :param end_time: (datetime) stop at the first chunk with only records after this time
+    :return: generator of Chunks
+    """
+    start = datetime_to_us(start_time) if start_time is not None else None
+    end = datetime_to_us(end_time) if end_time is not None else None
+    addresses = []
+    version = VERSION
+    while True:
+        magic = f.read(4)
+        if not magic:
+            return
+        if magic == MAGIC:
+            magic, version = _header.unpack(magic + _read_exactly(f, _header.size - 4))
+            if version not in VERSIONS:
+                raise ValueError("Unsupported binary RSSI log version {}.".format(version))
+            addresses = []
+            continue
+        if magic != CHUNK_MAGIC:
+            raise ValueError("Invalid binary RSSI log.")
+        magic, n, n_new, flags, reserved, t_min, t_max = _chunk_header.unpack(magic + _read_exactly(f, _chunk_header.size - 4))
+        if flags & ~KNOWN_FLAGS:
+            raise ValueError("Unsupported binary RSSI log flags 0x{:02x}.".format(flags))
+        new_addresses = _read_exactly(f, 6*n_new)
+        addresses = addresses + [address_to_string(new_addresses[6*k:6*k+6]) for k in xrange(n_new)]
+        size = n*11 + (n if flags & FLAG_TXPOWER else 0) + (4*n if flags & FLAG_BEACON else 0) + \
+               (n if flags & FLAG_ADAPTER else 0)
+        bounded = version >= 2 # Version 1 chunks have no time bounds, see the top of this file
+        if bounded and end is not None and t_min > end:
+            return
+        if bounded and start is not None and t_max < start:
+            _read_exactly(f, size)
+            continue
+        columns = _read_exactly(f, size)
+        time = numpy.frombuffer(columns, dtype="<i8", count=n, offset=0)
+        device = numpy.frombuffer(columns, dtype="<u2", count=n, offset=8*n)
+        rssi = numpy.frombuffer(columns, dtype="<i1", count=n, offset=10*n)
+        offset = 11*n
+        txpower = major = minor = adapter = None
+        if flags & FLAG_TXPOWER:
+            txpower = numpy.frombuffer(columns, dtype="<i1", count=n, offset=offset)
+            offset += n
+        if flags & FLAG_BEACON:
+            major = numpy.frombuffer(columns, dtype="<u2", count=n, offset=offset)
+            minor = numpy.frombuffer(columns, dtype="<u2", count=n, offset=offset+2*n)
+            offset += 4*n
+        if flags & FLAG_ADAPTER:
+            adapter = numpy.frombuffer(columns, dtype="u1", count=n, offset=offset)
+        yield Chunk(time, device, rssi, txpower, major, minor, adapter, addresses)
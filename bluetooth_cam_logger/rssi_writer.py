@@ -0,0 +1,137 @@
+# Buffered writer for the hourly .rssi (text) or .rssib (binary, see rssi_binary.py) log files.
+#
+# Records are collected in memory and written in batches, either when batch_size records are pending or
+# when flush_interval seconds passed since the last write. Each record goes to the file of the hour in
+# which it was received, so rotation follows the record timestamps rather than the time of writing. With
+# adapter_column, the number of the receiving adapter is stored as well (for loggers that scan with several
+# adapters).
+
+import os
+import time
+import datetime
+
+import blescan
+import rssi_binary
+
+# fsync policies
+FSYNC_NEVER = "never" # Leave it to the operating system
+FSYNC_ROTATE = "rotate" # When an hourly file is closed
+FSYNC_FLUSH = "flush" # After every batch
+
+
+class RssiWriter(object):
+    """
+    Writes AdvertisingReports as "<timestamp>\\t<address>\\t<rssi>[\\t<adapter>]" lines to hourly files named
+    %Y%m%d-%H.rssi in the output directory, or as chunks to %Y%m%d-%H.rssib files in binary mode.
+    """
+    def __init__(self, directory, batch_size=100, flush_interval=5.0, fsync=FSYNC_ROTATE, echo_every=0, binary=False,
+                 adapter_column=False):
+        """
+        :param directory: output directory
+        :param binary: write the binary format instead of text
+        :param batch_size: write when this many records are pending
+        :param flush_interval: (seconds) write pending records at least this often
+        :param fsync: FSYNC_NEVER, FSYNC_ROTATE or FSYNC_FLUSH
+        :param echo_every: print every n'th record to the console, 0 to disable
+        :param adapter_column: also write the adapter that received each record
+        """
+        if fsync not in (FSYNC_NEVER, FSYNC_ROTATE, FSYNC_FLUSH):
+            raise ValueError("Unknown fsync policy '{}'.".format(fsync))
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.echo_every = echo_every
+        self.binary = binary
+        self.adapter_column = adapter_column
+
+        self.pending = []
+        self.last_flush = time.time()
+        self.file = None
+        self.file_hour = None
+        self.chunk_writer = None
+        self.records = 0
+        self.address_strings = {}
+
+    def write(self, report):
+        self.pending.append(report)
+        self.records += 1
+        if self.echo_every and self.records % self.echo_every == 0:
+            print self.format(report, datetime.datetime.fromtimestamp(report.time)).rstrip()
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        # Flush pending records if flush_interval has passed, call this regularly when idle
+        if self.pending and time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        batch = []
+        for report in self.pending:
+            report_time = datetime.datetime.fromtimestamp(report.time)
+            hour = report_time.toordinal()*24 + report_time.hour
+            if hour != self.file_hour:
+                self.write_batch(batch)
+                batch = []
+                self.rotate(hour, report_time)
+            batch.append((report, report_time))
+        self.write_batch(batch)
+        self.pending = []
+        self.file.flush()
+        if self.fsync == FSYNC_FLUSH:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.close_file()
+
+    def format(self, report, report_time):
+        address = self.address_strings.get(report.address)
+        if address is None:
+            address = self.address_strings.setdefault(report.address, blescan.packed_bdaddr_to_string(report.address))
+        if self.adapter_column:
+            return "{}\t{}\t{}\t{}\n".format(report_time, address, report.rssi, report.adapter)
+        return "{}\t{}\t{}\n".format(report_time, address, report.rssi)
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+        if self.binary:
+            self.chunk_writer.write_chunk([rssi_binary.datetime_to_us(report_time) for report, report_time in batch],
+                                          [report.address for report, report_time in batch],
+                                          [report.rssi for report, report_time in batch],
+                                          [report.txpower for report, report_time in batch],
+                                          [report.major for report, report_time in batch],
+                                          [report.minor for report, report_time in batch],
+                                          [report.adapter for report, report_time in batch])
+        else:
+            self.file.write("".join(self.format(report, report_time) for report, report_time in batch))
+
+    def rotate(self, hour, report_time):
+        self.close_file()
+        if self.binary:
+            name = report_time.strftime("%Y%m%d-%H") + rssi_binary.EXTENSION
+            self.file = open(os.path.join(self.directory, name), 'ab')
+            flags = rssi_binary.FLAG_TXPOWER | rssi_binary.FLAG_BEACON
+            if self.adapter_column:
+                flags |= rssi_binary.FLAG_ADAPTER
+            self.chunk_writer = rssi_binary.ChunkWriter(self.file, flags)
+        else:
+            self.file = open(os.path.join(self.directory, report_time.strftime("%Y%m%d-%H.rssi")), 'a')
+        self.file_hour = hour
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            self.chunk_writer = None
+            self.file_hour = None
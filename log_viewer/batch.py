@@ -0,0 +1,133 @@
+# Headless analysis of many log .zip files.
+#
+# Every file is parsed, optionally filtered, and summarized per device: the number of samples, the time range,
+# the median, mean and variance of the RSSI (like log_viewer.py prints them) and, with a filter, the number and
+# total duration of the detected events (see events.py). Files are analyzed in parallel in a pool of worker
+# processes. This script does not import matplotlib or pygame, so it runs on machines without a display.
+#
+# Output: <output>-devices.<format> with one row per file and device, and with a filter <output>-events.<format>
+# with one row per event. Formats are csv, json (one <output>.json file with both tables) and parquet, which
+# requires pandas with a Parquet engine (e.g. pyarrow).
+
+import argparse
+import csv
+import datetime
+import json
+import multiprocessing
+import sys
+import traceback
+
+import numpy
+
+from log_parser import parseLog
+import log_cache
+from filters import filter_table
+from events import event_intervals, TIME_FORMAT
+
+FORMATS = ["csv", "json", "parquet"]
+DEVICE_COLUMNS = ["file", "address", "samples", "start", "end", "median", "mean", "variance", "events", "event_seconds"]
+EVENT_COLUMNS = ["file", "address", "start", "end", "duration", "peak"]
+
+# Read command line arguments
+parser = argparse.ArgumentParser(description="Summarize bluetooth rssi logs without a display.")
+parser.add_argument("input_files", nargs='+', help="log .zip files containing the RSSI data")
+parser.add_argument("--output", default="summary", help="name of the output files, without extension")
+parser.add_argument("--format", action="append", choices=FORMATS, help="output format (can be repeated, default csv)")
+parser.add_argument("--filter", default=None, help="filter used to detect events, see filters.py")
+parser.add_argument("--filterdata", default="", help="additional data for the filter")
+parser.add_argument("--start", default="2016-01-01 00:00:00", help="skip entries before this time ('YYYY-MM-DD HH:MM:SS')")
+parser.add_argument("--end", default="2050-01-01 00:00:00", help="skip entries after this time ('YYYY-MM-DD HH:MM:SS')")
+parser.add_argument("--device", default=None, help="only analyze this device address")
+parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="number of files analyzed in parallel")
+parser.add_argument("--cache-dir", default=log_cache.DEFAULT_DIRECTORY, help="directory to cache parsed logs in")
+parser.add_argument("--no-cache", action="store_true", help="do not use the cache of parsed logs")
+args = parser.parse_args()
+
+formats = args.format or ["csv"]
+if args.filter and args.filter not in filter_table:
+    print "Error: can't find filter function '{}'.".format(args.filter)
+    sys.exit(1)
+if "parquet" in formats:
+    try:
+        import pandas
+    except ImportError:
+        print "Error: Parquet output requires pandas."
+        sys.exit(1)
+
+start_time = datetime.datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
+end_time = datetime.datetime.strptime(args.end, "%Y-%m-%d %H:%M:%S")
+
+
+def format_time(time):
+    return time.strftime(TIME_FORMAT + ".%f")
+
+
+def analyze(filename):
+    """
+    :return: (device rows, event rows) of one log file, None if it could not be analyzed
+    """
+    try:
+        rssi_log = parseLog(filename, device_filter=args.device, start_time=start_time, end_time=end_time,
+                            cache_dir=None if args.no_cache else args.cache_dir, exit_on_empty=False)
+        devices = []
+        events = []
+        for address in sorted(rssi_log["addresses"]):
+            timestamp = rssi_log[address]["timestamp"]
+            rssi = rssi_log[address]["rssi"]
+            device = {"file": filename, "address": address, "samples": len(rssi),
+                      "start": format_time(timestamp[0].astype(datetime.datetime)),
+                      "end": format_time(timestamp[-1].astype(datetime.datetime)),
+                      "median": float(numpy.median(rssi)), "mean": float(numpy.mean(rssi)),
+                      "variance": float(numpy.var(rssi)), "events": None, "event_seconds": None}
+            if args.filter:
+                intervals = event_intervals(timestamp, filter_table[args.filter](timestamp, rssi, args.filterdata))
+                device["events"] = len(intervals)
+                device["event_seconds"] = sum(duration for unused, unused, duration, unused in intervals)
+                events.extend({"file": filename, "address": address, "start": format_time(start),
+                               "end": format_time(end), "duration": duration, "peak": peak}
+                              for start, end, duration, peak in intervals)
+            devices.append(device)
+        return devices, events
+    except Exception:
+        print "Error: can't analyze '{}':".format(filename)
+        traceback.print_exc()
+        return None
+
+
+def write_table(name, columns, rows):
+    for output_format in formats:
+        if output_format == "csv":
+            with open("{}-{}.csv".format(args.output, name), 'wb') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow(["" if row[column] is None else row[column] for column in columns])
+        elif output_format == "parquet":
+            pandas.DataFrame(rows, columns=columns).to_parquet("{}-{}.parquet".format(args.output, name))
+
+
+print "Analyzing {} files...".format(len(args.input_files))
+if args.jobs > 1 and len(args.input_files) > 1:
+    pool = multiprocessing.Pool(min(args.jobs, len(args.input_files)))
+    results = pool.map(analyze, args.input_files, chunksize=1)
+    pool.close()
+    pool.join()
+else:
+    results = map(analyze, args.input_files)
+
+failed = [filename for filename, result in zip(args.input_files, results) if result is None]
+devices = [device for result in results if result is not None for device in result[0]]
+events = [event for result in results if result is not None for event in result[1]]
+
+write_table("devices", DEVICE_COLUMNS, devices)
+if args.filter:
+    write_table("events", EVENT_COLUMNS, events)
+if "json" in formats:
+    with open(args.output + ".json", 'w') as f:
+        json.dump({"filter": args.filter, "filterdata": args.filterdata, "devices": devices,
+                   "events": events if args.filter else None}, f, indent=1, sort_keys=True)
+
+print "Summarized {} devices in {} files to '{}'.".format(len(devices), len(args.input_files) - len(failed), args.output)
+if failed:
+    print "Failed: {}".format(", ".join(failed))
+    sys.exit(1)
@@ -0,0 +1,261 @@
+# Benchmarks of the log parser and the filters, on synthetic data (see synthetic.py).
+#
+# Every measurement is the fastest of --repeat runs and is reported as samples per second. The filters and
+# parseLog are measured at every size in --sizes, so the throughput shows how their cost scales. Use --json to
+# save the results for comparisons between commits. The check section compares the sliding window filters with
+# their per-window reference implementations and exits with an error when they differ.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy
+
+from log_parser import parse_rssi_text, parse_rssi_text_bulk, parseLog
+from filters import filter_table, RunningStats, windowed_variance_detector
+from filters import window_bounds, window_filter, sliding_extremum, moving_minimum, moving_minimum_fn, moving_envelope, \
+    moving_envelope_fn, windowed_minimum_detector
+import synthetic
+
+SECTIONS = ["check", "parser", "stats", "filters", "parselog"]
+
+# Filter data used for the benchmarks, windows are in seconds or samples
+FILTER_DATA = {
+    "default": "",
+    "difference": "",
+    "moving_average": "60",
+    "moving_minimum": "60",
+    "moving_envelope": "60",
+    "moving_variance": "60",
+    "moving_average_event": "600,30",
+    "causal_ma_event": "600,30",
+    "wang2013": "1.6",
+    "youssef2007a": "50,10,0.1",
+    "youssef2007b": "20,10,3,2",
+    "youssef2007b_training": "20",
+    "windowed_variance": "300,10,3,1",
+    "windowed_average": "300,10,3",
+    "windowed_minimum": "60,5",
+    "histogram": "300",
+    "moving_histogram": "60",
+    "baseline": "300,10,3",
+}
+
+# Read command line arguments
+parser = argparse.ArgumentParser(description="Benchmark the log parser and the filters.")
+parser.add_argument("--samples", type=int, default=100000, help="number of RSSI samples in the parser test data")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs, the fastest run is reported")
+parser.add_argument("--filter-samples", type=int, default=20000, help="number of RSSI samples for the running statistics benchmarks")
+parser.add_argument("--windows", default="10,100,1000,10000", help="comma separated window sizes for the running statistics benchmarks")
+parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated numbers of samples for the filter and parseLog benchmarks")
+parser.add_argument("--rate", type=float, default=10.0, help="samples per second of the synthetic data")
+parser.add_argument("--noise", type=float, default=2.0, help="standard deviation (dB) of the synthetic RSSI")
+parser.add_argument("--events", type=float, default=1.0, help="attenuation events per hour in the synthetic data")
+parser.add_argument("--jitter", type=float, default=0.5, help="irregularity of the synthetic sample intervals (0..1)")
+parser.add_argument("--seed", type=int, default=1, help="random seed of the synthetic data")
+parser.add_argument("--sections", default=",".join(SECTIONS), help="comma separated benchmarks to run: " + ", ".join(SECTIONS))
+parser.add_argument("--filter", action="append", help="only benchmark this filter (can be repeated)")
+parser.add_argument("--json", default=None, help="write the results to this JSON file")
+args = parser.parse_args()
+
+sections = args.sections.split(',')
+sizes = [int(size) for size in args.sizes.split(',')]
+results = []
+
+
+def best_time(fn):
+    return min(timeit.repeat(fn, number=1, repeat=args.repeat))
+
+
+def quiet(fn):
+    # Call fn with its prints (e.g. from the youssef2007 filters) suppressed
+    def call():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return fn()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return call
+
+
+def record(section, name, samples, seconds, **parameters):
+    result = {"section": section, "name": name, "samples": samples, "seconds": seconds,
+              "samples_per_second": samples / seconds if seconds > 0 else None}
+    result.update(parameters)
+    results.append(result)
+
+
+def synthetic_trace(samples):
+    duration = samples / args.rate
+    return synthetic.generate_trace(duration, rate=args.rate, noise=args.noise,
+                                    events=int(round(args.events * duration / 3600.0)), jitter=args.jitter,
+                                    random=numpy.random.RandomState(args.seed))
+
+
+def generate_rssi_text(samples, devices=5, rate=10.0):
+    # Generate the contents of a .rssi file like bluetooth_cam_logger writes them
+    addresses = ["00:11:22:33:44:{:02x}".format(k) for k in xrange(devices)]
+    time = datetime.datetime(2016, 1, 1)
+    lines = []
+    for k in xrange(samples):
+        time += datetime.timedelta(seconds=random.expovariate(rate))
+        if k % 100 == 0:
+            time = time.replace(microsecond=0) # Incomplete timestamp, see datetime.__str__
+        lines.append("{}\t{}\t{}\n".format(time, random.choice(addresses), random.randint(-100, -30)))
+    return "".join(lines)
+
+
+def same(a, b):
+    # Element-wise equality, NaN equals NaN
+    a = numpy.asarray(a, dtype=float)
+    b = numpy.asarray(b, dtype=float)
+    return a.shape == b.shape and bool(numpy.all((a == b) | (numpy.isnan(a) & numpy.isnan(b))))
+
+
+def reference_windowed_minimum(rssi, window_size, threshold):
+    # windowed_minimum_detector as it was before MonotonicQueue, with min() over a list
+    window = []
+    result = []
+    for value in rssi:
+        if len(window) < window_size or value > min(window) - threshold:
+            window.append(value)
+            if len(window) > window_size:
+                window.pop(0)
+        result.append(min(window) - threshold - value)
+    return result
+
+
+def reference_envelope(time, rssi, window):
+    # moving_envelope_fn per window, NaN for empty windows
+    return [moving_envelope_fn(time, rssi, None, start, end) if end > start else float('NaN')
+            for start, end in zip(*window_bounds(time, window))]
+
+
+# Sliding minimum/maximum against the per-window min() and max()
+if "check" in sections:
+    print "Checking the sliding window filters against their reference implementations..."
+    random_state = numpy.random.RandomState(args.seed)
+    cases = [("random", synthetic_trace(2000)[:2]),
+             ("equal values", (synthetic_trace(500)[0], numpy.full(500, -60))),
+             ("few levels", (synthetic_trace(1000)[0], random_state.randint(-62, -58, 1000))),
+             ("single sample", (synthetic_trace(1)[0], numpy.array([-60]))),
+             ("empty", (numpy.zeros(0, dtype="datetime64[us]"), numpy.zeros(0, dtype=int)))]
+    failures = []
+    for name, (timestamp, rssi) in cases:
+        # Window sizes from empty windows (0 s) up to windows larger than the data
+        for seconds in [0.0, 0.05, 1.0, 30.0, 1e6]:
+            window = datetime.timedelta(seconds=seconds)
+            if not same(moving_minimum(timestamp, rssi, str(seconds)),
+                        window_filter(timestamp, rssi, window, moving_minimum_fn)):
+                failures.append("moving_minimum, {}, {} s".format(name, seconds))
+            if not same(moving_envelope(timestamp, rssi, str(seconds)), reference_envelope(timestamp, rssi, window)):
+                failures.append("moving_envelope, {}, {} s".format(name, seconds))
+        for window_size in [1, 5, 100, 1e6]:
+            for threshold in [0.0, 3.0]:
+                data = "{},{}".format(window_size, threshold)
+                if not same(windowed_minimum_detector(timestamp, rssi, data),
+                            reference_windowed_minimum(rssi.tolist(), window_size, threshold)):
+                    failures.append("windowed_minimum, {}, {}".format(name, data))
+        # Arbitrary non-decreasing window bounds, including empty windows
+        n = len(rssi)
+        bounds = numpy.sort(random_state.randint(0, n + 1, (2, 3*n + 1)), axis=1)
+        window_start, window_end = numpy.minimum(bounds[0], bounds[1]), bounds[1]
+        for maximum in [False, True]:
+            reference = [(max if maximum else min)(rssi[start:end]) if end > start else float('NaN')
+                         for start, end in zip(window_start, window_end)]
+            if not same(sliding_extremum(rssi, window_start, window_end, maximum), reference):
+                failures.append("sliding_extremum, {}, maximum={}".format(name, maximum))
+    if failures:
+        print "Mismatches:\n  " + "\n  ".join(failures)
+        sys.exit(1)
+    print "All {} cases match.".format(len(cases))
+
+# Text parser, line by line versus bulk
+if "parser" in sections:
+    random.seed(args.seed)
+    data = generate_rssi_text(args.samples)
+    print "Parsing {} samples ({} bytes)...".format(args.samples, len(data))
+    line_time = best_time(lambda: list(parse_rssi_text(data)))
+    bulk_time = best_time(quiet(lambda: parse_rssi_text_bulk(data)))
+    print "Line by line: {:.3f} s ({:.0f} samples/s)".format(line_time, args.samples / line_time)
+    print "Bulk:         {:.3f} s ({:.0f} samples/s)".format(bulk_time, args.samples / bulk_time)
+    print "Speedup: {:.1f}x".format(line_time / bulk_time)
+    record("parser", "parse_rssi_text", args.samples, line_time)
+    record("parser", "parse_rssi_text_bulk", args.samples, bulk_time)
+
+# Running statistics, the cost per sample should not depend on the window size
+if "stats" in sections:
+    rssi = numpy.random.RandomState(args.seed).randint(-100, -30, args.filter_samples).tolist()
+    print "\nRunning statistics over {} samples (time per sample)...".format(args.filter_samples)
+    print "{:>8} {:>16} {:>20}".format("window", "RunningStats", "windowed_variance")
+    for window in [int(w) for w in args.windows.split(',')]:
+        def update_stats():
+            stats = RunningStats(window)
+            for value in rssi:
+                stats.update(value)
+                stats.variance()
+        stats_time = best_time(update_stats)
+        detector_time = best_time(lambda: windowed_variance_detector(None, rssi, "{},{},3,1".format(window, window)))
+        print "{:>8} {:>13.2f} us {:>18.2f} us".format(window, 1e6 * stats_time / args.filter_samples,
+                                                      1e6 * detector_time / args.filter_samples)
+        record("stats", "RunningStats", args.filter_samples, stats_time, window=window)
+        record("stats", "windowed_variance", args.filter_samples, detector_time, window=window)
+
+# Filters at every size
+if "filters" in sections:
+    names = sorted(args.filter or filter_table.keys())
+    print "\nFilters (samples/s)..."
+    print "{:<24}".format("filter") + "".join("{:>14}".format(size) for size in sizes)
+    traces = dict((size, synthetic_trace(size)) for size in sizes)
+    for name in names:
+        if name not in FILTER_DATA:
+            print "{:<24} no benchmark data".format(name)
+            continue
+        line = "{:<24}".format(name)
+        for size in sizes:
+            timestamp, rssi, unused = traces[size]
+            filter_time = best_time(quiet(lambda: filter_table[name](timestamp, rssi, FILTER_DATA[name])))
+            record("filters", name, len(rssi), filter_time, data=FILTER_DATA[name])
+            line += "{:>14.0f}".format(len(rssi) / filter_time)
+        print line
+
+# parseLog of text and binary logs at every size, without cache
+if "parselog" in sections:
+    print "\nparseLog (samples/s)..."
+    print "{:<24}".format("format") + "".join("{:>14}".format(size) for size in sizes)
+    directory = tempfile.mkdtemp(prefix="rssi-benchmark-")
+    try:
+        logs = {}
+        for size in sizes:
+            devices = 5
+            logs[size] = synthetic.generate_log(size / args.rate / devices, devices=devices, rate=args.rate,
+                                                noise=args.noise, jitter=args.jitter,
+                                                random=numpy.random.RandomState(args.seed))
+        for binary in [False, True]:
+            line = "{:<24}".format("binary" if binary else "text")
+            for size in sizes:
+                filename = os.path.join(directory, "log-{}.zip".format(size))
+                synthetic.write_log_zip(filename, logs[size], binary=binary)
+                samples = sum(len(logs[size][address]["rssi"]) for address in logs[size]["addresses"])
+                parse_time = best_time(quiet(lambda: parseLog(filename)))
+                record("parselog", "binary" if binary else "text", samples, parse_time)
+                line += "{:>14.0f}".format(samples / parse_time)
+            print line
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if args.json:
+    with open(args.json, 'w') as f:
+        json.dump({"time": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                   "numpy": numpy.__version__, "arguments": vars(args), "results": results}, f, indent=1,
+                  sort_keys=True)
+    print "Results written to {}.".format(args.json)
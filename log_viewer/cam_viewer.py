@@ -1,13 +1,19 @@
 import argparse
 import datetime
 import zipfile
-import time
+import sys
 
-from show_image import show_image
+import pygame
+
+from show_image import FrameIndex, get_screen, resolution
+from playback import Player
 
 parser = argparse.ArgumentParser(description="Webcam zipped image viewer.")
 parser.add_argument("input_file", help="log .zip file containing the webcam images")
 parser.add_argument("--start", default="2016-01-01 00:00:00", help="(YYYY-MM-DD HH:MM:SS) start time")
+parser.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier")
+parser.add_argument("--max-fps", type=float, default=10.0, help="maximum frame rate, frames are skipped at high speeds")
+parser.add_argument("--prefetch", type=int, default=16, help="number of frames decoded ahead")
 args = parser.parse_args()
 
 filename = args.input_file
@@ -15,15 +21,39 @@ time_start = datetime.datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
 
 
 zf = zipfile.ZipFile(filename)
-time_current = time_start
-real_time_current = datetime.datetime.now()
-while True:
-    try:
-        show_image(zf, time_current)
-    except:
-        print "Can't show image at time {}.".format(time_current)
-    while datetime.datetime.now().second == real_time_current.second:
-        time.sleep(0.01)
-    real_time_current = datetime.datetime.now()
-    time_current += datetime.timedelta(seconds=1.0)
+index = FrameIndex(zf)
+if len(index) == 0:
+    print "No images found in '{}'.".format(filename)
+    sys.exit(1)
+if time_start < index.time(0):
+    time_start = index.time(0)
 
+screen = get_screen()
+print "Keys: space = pause, left/right = -/+ 1 minute, page up/down = -/+ 1 hour, up/down = faster/slower."
+player = Player(zf, index, resolution, time_start, speed=args.speed, max_fps=args.max_fps, prefetch=args.prefetch)
+jumps = {pygame.K_LEFT: -60, pygame.K_RIGHT: 60, pygame.K_PAGEUP: -3600, pygame.K_PAGEDOWN: 3600}
+clock = pygame.time.Clock()
+running = True
+while running:
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            running = False
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE:
+                player.toggle_pause()
+            elif event.key in jumps:
+                player.jump(jumps[event.key])
+            elif event.key == pygame.K_UP:
+                player.set_speed(player.speed * 2)
+                print "Speed: {}x".format(player.speed)
+            elif event.key == pygame.K_DOWN:
+                player.set_speed(player.speed / 2)
+                print "Speed: {}x".format(player.speed)
+    frame = player.next_frame()
+    if frame:
+        time_current, name, image = frame
+        pygame.display.set_caption("{} ({}x)".format(time_current, player.speed))
+        screen.blit(image, (0,0))
+        pygame.display.flip()
+    clock.tick(60)
+player.close()
@@ -0,0 +1,61 @@
+import argparse
+import zipfile
+import sys
+import os
+from io import BytesIO
+
+import rssi_binary
+from log_parser import parse_rssi_text_lenient
+
+# Read command line arguments
+parser = argparse.ArgumentParser(description="Convert the .rssi text logs in a log .zip file to the binary .rssib format.")
+parser.add_argument("input_file", help="log .zip file containing .rssi files")
+parser.add_argument("output_file", help="output .zip file, other files (e.g. webcam images) are copied as-is")
+parser.add_argument("--chunk", type=int, default=65536, help="number of records per binary chunk")
+parser.add_argument("--compress", action="store_true", help="deflate the .rssib files (smaller, but slower to load)")
+args = parser.parse_args()
+
+if os.path.exists(args.output_file):
+    print "Error: output file '{}' already exists.".format(args.output_file)
+    sys.exit(1)
+
+compression = zipfile.ZIP_DEFLATED if args.compress else zipfile.ZIP_STORED
+
+# Write to a temporary file that is only renamed to the output file when the conversion succeeded
+temporary_file = args.output_file + ".tmp"
+zf_in = zipfile.ZipFile(args.input_file)
+zf_out = zipfile.ZipFile(temporary_file, 'w', allowZip64=True)
+try:
+    for info in zf_in.infolist():
+        if not info.filename.endswith(".rssi"):
+            zf_out.writestr(info, zf_in.read(info.filename))
+            continue
+        name = info.filename[:-len(".rssi")] + rssi_binary.EXTENSION
+        print "Converting {} to {}...".format(info.filename, name)
+        # Malformed lines (e.g. a last line that was cut off when the logger stopped) are skipped
+        records = list(parse_rssi_text_lenient(zf_in.read(info.filename), adapter=True))
+        # Logs of several adapters have an adapter column, which is kept (see rssi_binary.FLAG_ADAPTER)
+        has_adapter = any(record[3] is not None for record in records)
+        if has_adapter:
+            # Lines without the column were cut off, e.g. '...\t-6' instead of '...\t-61\t0'
+            skipped = [record for record in records if record[3] is None]
+            if skipped:
+                print "(Skipping {} lines without adapter column)".format(len(skipped))
+                records = [record for record in records if record[3] is not None]
+        output = BytesIO()
+        writer = rssi_binary.ChunkWriter(output, flags=rssi_binary.FLAG_ADAPTER if has_adapter else 0)
+        for start in xrange(0, len(records), args.chunk):
+            chunk = records[start:start+args.chunk]
+            writer.write_chunk([rssi_binary.datetime_to_us(record[0]) for record in chunk],
+                               [rssi_binary.string_to_address(record[1]) for record in chunk],
+                               [record[2] for record in chunk],
+                               adapter=[record[3] for record in chunk])
+        zf_out.writestr(zipfile.ZipInfo(name, info.date_time), output.getvalue(), compression)
+        print "{} bytes -> {} bytes.".format(info.file_size, len(output.getvalue()))
+    zf_out.close()
+    os.rename(temporary_file, args.output_file)
+finally:
+    zf_out.close()
+    if os.path.exists(temporary_file):
+        os.remove(temporary_file)
+print "Done."
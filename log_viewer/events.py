@@ -0,0 +1,138 @@
+# Events in filtered RSSI data, and scoring of detected events against labelled (ground truth) events.
+#
+# An event starts at the first sample where the filter output is larger than 0 and ends at the first sample
+# after it where the output is 0 or less (see log_viewer.py --event). NaN outputs do not change the state.
+#
+# Labelled events are read from a CSV file with "start,end[,address]" rows, times as 'YYYY-MM-DD HH:MM:SS' with
+# optional fractional seconds. A label without an address applies to all devices. Empty lines, lines starting
+# with '#' and a header row are skipped. Detected events are written by write_events in the same format, with the
+# duration and peak filter output as extra columns, so they can be used as labels as well.
+
+import csv
+import datetime
+
+import numpy
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def event_state(filtered):
+    # True where an event is in progress: the output is larger than 0, NaN outputs keep the previous state
+    values = numpy.asarray(filtered, dtype=float)
+    valid = ~numpy.isnan(values)
+    last_valid = numpy.maximum.accumulate(numpy.where(valid, numpy.arange(len(values)), 0))
+    with numpy.errstate(invalid="ignore"):
+        return (values > 0)[last_valid] & valid[last_valid]
+
+
+def find_events(filtered):
+    """
+    :param filtered: filter output
+    :return: [(start, end), ...] sample indices of the events, end is the first sample after the event. Events that
+        have not ended at the last sample are not included.
+    """
+    edges = numpy.diff(numpy.concatenate([[0], event_state(filtered).astype(numpy.int8)]))
+    starts = numpy.flatnonzero(edges == 1)
+    ends = numpy.flatnonzero(edges == -1)
+    return zip(starts[:len(ends)].tolist(), ends.tolist())
+
+
+def event_intervals(timestamp, filtered):
+    """
+    :param timestamp: datetime64 array
+    :param filtered: filter output
+    :return: [(start, end, duration, peak), ...] start and end datetimes of the events (see find_events), duration
+        in seconds and the largest filter output during the event
+    """
+    events = find_events(filtered)
+    if not events:
+        return []
+    timestamp = numpy.asarray(timestamp).astype("datetime64[us]")
+    starts, ends = numpy.array(events).T
+    peaks = numpy.fmax.reduceat(numpy.asarray(filtered, dtype=float), numpy.array(events).ravel())[::2]
+    durations = (timestamp[ends] - timestamp[starts]).astype(numpy.int64) / 1e6
+    return zip(timestamp[starts].astype(datetime.datetime), timestamp[ends].astype(datetime.datetime),
+               durations.tolist(), peaks.tolist())
+
+
+def write_events(filename, intervals):
+    """
+    :param intervals: {address: [(start, end, duration, peak), ...]}, see event_intervals
+    """
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["start", "end", "address", "duration", "peak"])
+        rows = [(start, end, address, duration, peak) for address, events in intervals.iteritems()
+                for start, end, duration, peak in events]
+        for start, end, address, duration, peak in sorted(rows):
+            writer.writerow([start.strftime(TIME_FORMAT + ".%f"), end.strftime(TIME_FORMAT + ".%f"), address,
+                             "{:.6f}".format(duration), peak])
+
+
+def parse_time(text):
+    # TIME_FORMAT with optional fractional seconds
+    if '.' in text:
+        return datetime.datetime.strptime(text, TIME_FORMAT + ".%f")
+    return datetime.datetime.strptime(text, TIME_FORMAT)
+
+
+def read_labels(filename):
+    """
+    :return: [(start, end, address), ...] labelled events, address is None for labels that apply to all devices
+    """
+    labels = []
+    with open(filename) as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            try:
+                start = parse_time(row[0].strip())
+                end = parse_time(row[1].strip())
+            except (ValueError, IndexError):
+                if not labels and row[0].strip().lower() == "start":
+                    continue # Header
+                raise ValueError("Invalid label '{}' in {}.".format(",".join(row), filename))
+            address = row[2].strip().lower() if len(row) > 2 and row[2].strip() else None
+            labels.append((start, end, address))
+    return labels
+
+
+def score(detections, labels, tolerance=datetime.timedelta(0)):
+    """
+    Match detected events to labelled events, a detection matches a label when they overlap.
+    :param detections: {address: [(start, end), ...]} detected events as datetimes
+    :param labels: labelled events, see read_labels
+    :param tolerance: (timedelta) widen the labels by this much on both sides
+    :return: {
+        ["detections"]: number of detected events
+        ["precision"]: fraction of detections that match a label (0 without detections)
+        ["recall"]: fraction of labels that are matched by a detection
+        ["f1"]: harmonic mean of precision and recall
+        ["latency"]: mean time (s) from the start of a matched label to its first detection, None without matches }
+    """
+    detected = 0
+    true_positives = 0
+    latencies = {}
+    for address, events in detections.iteritems():
+        for start, end in events:
+            detected += 1
+            matched = False
+            for k, (label_start, label_end, label_address) in enumerate(labels):
+                if label_address not in (None, address):
+                    continue
+                if start <= label_end + tolerance and end >= label_start - tolerance:
+                    matched = True
+                    latency = (start - label_start).total_seconds()
+                    latencies[k] = min(latencies.get(k, latency), latency)
+            if matched:
+                true_positives += 1
+
+    precision = float(true_positives) / detected if detected else 0.0
+    recall = float(len(latencies)) / len(labels) if labels else 0.0
+    return {
+        "detections": detected,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2*precision*recall / (precision+recall) if precision+recall > 0 else 0.0,
+        "latency": sum(latencies.values()) / len(latencies) if latencies else None,
+    }
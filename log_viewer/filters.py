@@ -1,12 +1,15 @@
 # This file contains filters to post-process RSSI data.
-# Filter functions get called with a list of datetime timestamps, a list of integer RSSI values and a string with
-# optional input. The functions return a list of data points corresponding to the input timestamps.
+# Filter functions get called with timestamps (a list of datetimes or a numpy datetime64 array), a list or array of
+# integer RSSI values and a string with optional input. The functions return a list or numpy array of data points
+# corresponding to the input timestamps.
 
 import numpy
 import datetime
 import math
+import operator
 
-from collections import Counter
+from collections import deque
+from numpy.lib.stride_tricks import as_strided
 
 def template_function(time, rssi, data):
     return rssi
@@ -16,25 +19,45 @@ def difference(time, rssi, data):
     return [0.0] + numpy.diff(rssi).tolist()
 
 
-def window_filter(time, rssi, window, filter_fn, data=None):
-    window_start = 0
-    window_end = 0
+def to_microseconds(time):
+    # Timestamps as an int64 array of microseconds
+    return numpy.asarray(time, dtype="datetime64[us]").astype(numpy.int64)
 
-    result = []
-    for t in time:
-        while time[window_start] < t - window/2:
-            window_start += 1
-        while time[window_end] < t + window/2 and window_end < len(time)-1:
-            window_end += 1
-        filtered_value = filter_fn(time, rssi, data, window_start, window_end)
-        result.append(filtered_value)
-    return result
+
+def timedelta_microseconds(delta):
+    return (delta.days*86400 + delta.seconds)*1000000 + delta.microseconds
+
+
+def window_bounds(time, window):
+    # Start and end indices of the window of +/- window/2 around every sample, see window_filter. Note that the
+    # end index never exceeds the last sample and that the timestamps should be in increasing order.
+    t = to_microseconds(time)
+    if len(t) == 0:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    half = timedelta_microseconds(window) // 2
+    window_start = numpy.searchsorted(t, t - half, side="left")
+    window_end = numpy.minimum(numpy.searchsorted(t, t + half, side="left"), len(t)-1)
+    return window_start, window_end
+
+
+def window_filter(time, rssi, window, filter_fn, data=None):
+    window_start, window_end = window_bounds(time, window)
+    return [filter_fn(time, rssi, data, start, end) for start, end in zip(window_start, window_end)]
 
 
 def moving_average(time, rssi, data):
     window = datetime.timedelta(seconds=float(data)) # Window in seconds
-    cumsum = numpy.cumsum(rssi) # Precalculate cumulative sum
-    return window_filter(time, rssi, window, moving_average_fn, cumsum)
+    return windowed_average(time, rssi, window)
+
+def windowed_average(time, rssi, window):
+    # Equal to moving_average_fn for every window, computed from a cumulative sum of rssi values
+    window_start, window_end = window_bounds(time, window)
+    cumsum = numpy.cumsum(rssi)
+    count = window_end - window_start
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        result = (cumsum[window_end]-cumsum[window_start]).astype(float) / count
+    result[count == 0] = float('NaN')
+    return result
 
 def moving_average_fn(time, rssi, cumsum, window_start, window_end):
     # Data contains a cumsum list of rssi values
@@ -46,15 +69,83 @@ def moving_average_fn(time, rssi, cumsum, window_start, window_end):
 
 def moving_variance(time, rssi, data):
     window = datetime.timedelta(seconds=float(data)) # Window in seconds
-    return window_filter(time, rssi, window, moving_variance_fn)
+    window_start, window_end = window_bounds(time, window)
+    return sliced_variance(rssi, window_start, window_end)
+
+def sliced_variance(values, start, end):
+    # Population variance of values[start[k]:end[k]] for every k from cumulative sums of values and their squares,
+    # NaN for empty slices. For integer values the sums are exact, so the result only has the rounding of the final
+    # division.
+    values = numpy.asarray(values)
+    if values.dtype.kind not in "iub":
+        values = values.astype(float)
+    else:
+        values = values.astype(numpy.int64)
+    sums = numpy.concatenate([[0], numpy.cumsum(values)])
+    squares = numpy.concatenate([[0], numpy.cumsum(values*values)])
+    count = end - start
+    s1 = sums[end] - sums[start]
+    s2 = squares[end] - squares[start]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        result = numpy.maximum((count*s2 - s1*s1).astype(float), 0.0) / (count*count).astype(float)
+    result[count == 0] = float('NaN')
+    return result
 
 def moving_variance_fn(time, rssi, unused, window_start, window_end):
     return numpy.var(rssi[window_start:window_end])
 
 
+class MonotonicQueue(object):
+    """
+    FIFO queue of values that keeps track of their minimum (or maximum). Only the values that can still become the
+    extremum are stored, in monotonic order, so push and pop take amortized O(1) time.
+    """
+    def __init__(self, maximum=False):
+        self.replaces = operator.ge if maximum else operator.le
+        self.candidates = deque() # (index, value), the extremum is at the front
+        self.first = 0 # Index of the oldest value in the queue
+        self.next = 0 # Index of the next value that is pushed
+
+    def __len__(self):
+        return self.next - self.first
+
+    def push(self, value):
+        while self.candidates and self.replaces(value, self.candidates[-1][1]):
+            self.candidates.pop()
+        self.candidates.append((self.next, value))
+        self.next += 1
+
+    def pop(self):
+        # Remove the oldest value
+        if self.candidates and self.candidates[0][0] == self.first:
+            self.candidates.popleft()
+        self.first = min(self.first + 1, self.next)
+
+    def extremum(self):
+        if not self.candidates:
+            return float('NaN')
+        return self.candidates[0][1]
+
+
+def sliding_extremum(values, window_start, window_end, maximum=False):
+    # Minimum (or maximum) of values[window_start[k]:window_end[k]] for every k, NaN for empty windows. The window
+    # bounds should never decrease (see window_bounds), so every value is pushed and popped only once.
+    values = numpy.asarray(values).tolist()
+    queue = MonotonicQueue(maximum)
+    result = []
+    for start, end in zip(window_start, window_end):
+        while queue.next < end:
+            queue.push(values[queue.next])
+        while queue.first < start:
+            queue.pop()
+        result.append(queue.extremum())
+    return result
+
+
 def moving_minimum(time, rssi, data):
     window = datetime.timedelta(seconds=float(data)) # Window in seconds
-    return window_filter(time, rssi, window, moving_minimum_fn)
+    window_start, window_end = window_bounds(time, window)
+    return sliding_extremum(rssi, window_start, window_end)
 
 def moving_minimum_fn(time, rssi, unused, window_start, window_end):
     if len(rssi[window_start:window_end]) <= 0:
@@ -64,7 +155,10 @@ def moving_minimum_fn(time, rssi, unused, window_start, window_end):
 
 def moving_envelope(time, rssi, data):
     window = datetime.timedelta(seconds=float(data)) # Window in seconds
-    return window_filter(time, rssi, window, moving_envelope_fn)
+    window_start, window_end = window_bounds(time, window)
+    minimum = sliding_extremum(rssi, window_start, window_end)
+    maximum = sliding_extremum(rssi, window_start, window_end, maximum=True)
+    return [high - low for high, low in zip(maximum, minimum)]
 
 def moving_envelope_fn(time, rssi, unused, window_start, window_end):
     return max(rssi[window_start:window_end]) - min(rssi[window_start:window_end])
@@ -73,32 +167,28 @@ def moving_average_event(time, rssi, data):
     data_fields = data.split(',')
     window_background = datetime.timedelta(seconds=float(data_fields[0]))
     window_event = datetime.timedelta(seconds=float(data_fields[1]))
-    background = window_filter(time, rssi, window_background, moving_average_fn)
-    event = window_filter(time, rssi, window_event, moving_average_fn)
-    return [ev - back for ev, back in zip(event, background)]
+    background = windowed_average(time, rssi, window_background)
+    event = windowed_average(time, rssi, window_event)
+    return event - background
 
 
 def causal_ma_event(time, rssi, data):
     data_fields = data.split(',')
     window_background = datetime.timedelta(seconds=float(data_fields[0]))
     window_event = datetime.timedelta(seconds=float(data_fields[1]))
-    window_end = 0
-    window_background_start = 0
-    window_event_start = 0
 
-    result = []
-    for t in time:
-        while time[window_event_start] < t - window_event:
-            window_event_start += 1
-        while time[window_background_start] < time[window_event_start] - window_background:
-            window_background_start += 1
-        if window_end > window_event_start and window_event_start > window_background_start:
-            diff = min(0, numpy.mean(rssi[window_event_start:window_end]) - numpy.mean(rssi[window_background_start:window_event_start]))
-        else:
-            diff = 0
-        result.append(diff)
-        window_end += 1
-    return result
+    # Event window: [window_event_start, k), background window: [window_background_start, window_event_start)
+    t = to_microseconds(time)
+    window_end = numpy.arange(len(t))
+    window_event_start = numpy.searchsorted(t, t - timedelta_microseconds(window_event), side="left")
+    window_background_start = numpy.searchsorted(t, t[window_event_start] - timedelta_microseconds(window_background),
+                                                  side="left")
+    sums = numpy.concatenate([[0], numpy.cumsum(rssi)]).astype(float)
+    valid = (window_end > window_event_start) & (window_event_start > window_background_start)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        event = (sums[window_end] - sums[window_event_start]) / (window_end - window_event_start)
+        background = (sums[window_event_start] - sums[window_background_start]) / (window_event_start - window_background_start)
+        return numpy.where(valid, numpy.minimum(0, event - background), 0.0)
 
 
 def wang2013(time, rssi, data):
@@ -108,6 +198,24 @@ def wang2013(time, rssi, data):
     return [-2*sigma - diff for diff in difference(time, rssi, data)]
 
 
+def sliding_windows(values, size):
+    # Read-only view of values with the windows values[k:k+size] as rows
+    values = numpy.ascontiguousarray(values)
+    count = max(0, len(values) - size + 1)
+    return as_strided(values, shape=(count, size), strides=(values.strides[0], values.strides[0]), writeable=False)
+
+
+def sliding_variance(values, size, block_size=1000000):
+    # numpy.var(values[k:k+size]) for every k. The windows are processed in blocks of about block_size values, so
+    # the temporary arrays stay small. numpy.var reduces every row the same way, the results are equal to those of
+    # the separate calls.
+    windows = sliding_windows(values, size)
+    rows = max(1, block_size // max(1, size))
+    if len(windows) == 0:
+        return numpy.zeros(0)
+    return numpy.concatenate([windows[k:k+rows].var(axis=1) for k in xrange(0, len(windows), rows)])
+
+
 def youssef2007a(time, rssi, data):
     # Data: wl,ws,tau
     # Result: obstacle detected when signal is larger than 0.
@@ -119,16 +227,12 @@ def youssef2007a(time, rssi, data):
 
     cumsum = numpy.cumsum(rssi)
 
-    result = []
-    for k in xrange(-ws-wl+1, len(rssi)-ws-wl+1):
-        if k >= 0:
-            alk = 1/float(wl) * (cumsum[k+wl-1] - cumsum[k])
-            ask = 1/float(ws) * (cumsum[k+wl+ws-1] - cumsum[k+wl])
-            result.append(abs((alk-ask)/alk) - tau)
-            # print "{}: wl = {}, ws = {}, alk = {}, ask = {}. rel.diff = {}".format(k, wl, ws, alk, ask, abs((alk-ask)/alk))
-        else:
-            result.append(False)
-    return result
+    # Long window [k, k+wl-1) and short window [k+wl, k+wl+ws-1) of cumsum differences, the output for k is at
+    # index k+wl+ws-1 and the first outputs are False
+    k = numpy.arange(max(0, len(rssi)-ws-wl+1))
+    alk = 1/float(wl) * (cumsum[k+wl-1] - cumsum[k])
+    ask = 1/float(ws) * (cumsum[k+wl+ws-1] - cumsum[k+wl])
+    return [False] * min(len(rssi), ws+wl-1) + (abs((alk-ask)/alk) - tau).tolist()
 
 
 def youssef2007b(time, rssi, data):
@@ -140,30 +244,58 @@ def youssef2007b(time, rssi, data):
     sigmav = float(data_fields[2])
     r = float(data_fields[3])
 
-    result = []
-    for k in xrange(-w+1, len(rssi)-w+1):
-        if k >= 0:
-            vt = youssef2007b_vt(rssi[k:k+w-1])
-            result.append(vt - vtbar - r*sigmav)
-        else:
-            result.append(0.0)
-    return result
+    # The variance of rssi[k:k+w-1] is the output at index k+w-1, the first outputs are 0.0
+    vt = youssef2007b_vt(rssi, w)
+    return [0.0] * min(len(rssi), w-1) + (vt - vtbar - r*sigmav).tolist()
 
-def youssef2007b_vt(qi):
-    return numpy.var(qi)
+def youssef2007b_vt(rssi, w):
+    # Variance of rssi[k:k+w-1] for k = 0 .. len(rssi)-w
+    return sliding_variance(rssi, w-1)[:max(0, len(rssi)-w+1)]
 
 def youssef2007b_training(time, rssi, data):
     # Data: w
     w = int(data)
 
-    vt = []
-    for k in xrange(0,len(rssi)-w+1):
-        vt.append(youssef2007b_vt(rssi[k:k+w-1]))
+    vt = youssef2007b_vt(rssi, w)
     # print "Training results:\n vtbar = {}, sigmav = {}.".format(numpy.mean(vt), numpy.std(vt, ddof=len(vt)-w+1))
     print "Training results:\n vtbar = {}, sigmav = {}.".format(numpy.mean(vt), numpy.std(vt))
     return rssi
 
 
+class RunningStats(object):
+    """
+    Mean and variance of the last size values in a preallocated ring buffer. The buffer starts filled with the
+    initial value, so the statistics are always taken over size values (also while the first values come in).
+    The update is the sliding window form of Welford's algorithm, which takes O(1) time and does not lose
+    precision when the mean is large compared to the variance.
+    """
+    def __init__(self, size, initial=0.0):
+        self.size = size
+        self.buffer = [initial] * size
+        self.position = 0 # Index of the oldest value
+        self.mean = float(initial)
+        self.m2 = 0.0 # Sum of squared differences from the mean
+
+    def update(self, new):
+        """
+        Replace the oldest value by new.
+        :return: the value that was removed from the window
+        """
+        old = self.buffer[self.position]
+        self.buffer[self.position] = new
+        self.position += 1
+        if self.position == self.size:
+            self.position = 0
+        delta = new - old
+        old_mean = self.mean
+        self.mean += delta / float(self.size)
+        self.m2 += delta * (new - self.mean + old - old_mean)
+        return old
+
+    def variance(self):
+        return max(0.0, self.m2 / self.size)
+
+
 def windowed_variance_detector(time, rssi, data):
     data_fields = data.split(',')
     wbase = int(data_fields[0])
@@ -171,26 +303,19 @@ def windowed_variance_detector(time, rssi, data):
     r = float(data_fields[2])
     std_min = float(data_fields[3])
 
-    psa_base = 0
-    sma_base = 0
-    psa_var = 0
-    sma_var = 0
-    psa_event = 0
-    sma_event = 0
-
-    queue_base = [0] * winstant
-    queue_var = [0] * wbase
-    queue_event = [0] * winstant
+    stats_base = RunningStats(winstant)
+    stats_var = RunningStats(wbase)
+    stats_event = RunningStats(winstant)
 
     result = []
-    for k in xrange(len(rssi)):
+    for value in numpy.asarray(rssi).tolist():
         # Update the moving variances of RSSI
-        var_event, queue_event, psa_event, sma_event, shift = running_variance(queue_event, psa_event, sma_event, rssi[k])
-        var_base, queue_base, psa_base, sma_base, unused = running_variance(queue_base, psa_base, sma_base, shift)
+        shift = stats_event.update(value)
+        stats_base.update(shift)
         # Update the variance of the base RSSI variance
-        var_var, queue_var, psa_var, sma_var, unused = running_variance(queue_var, psa_var, sma_var, var_base)
+        stats_var.update(stats_base.variance())
         # Calculate the output of the filter
-        result.append(var_event - sma_var - r*max(std_min, math.sqrt(var_var)))
+        result.append(stats_event.variance() - stats_var.mean - r*max(std_min, math.sqrt(stats_var.variance())))
     return result
 
 
@@ -200,26 +325,22 @@ def windowed_average_detector(time, rssi, data):
     winstant = int(data_fields[1])
     r = float(data_fields[2])
 
-    psa_base = 0
-    sma_base = 0
-    psa_event = 0
-    sma_event = 0
-
-    queue_base = [0] * wbase
-    queue_event = [0] * winstant
+    stats_base = RunningStats(wbase)
+    stats_event = RunningStats(winstant)
 
     var_base = 10000
 
     result = []
-    for k in xrange(len(rssi)):
-        # Update the moving variances of RSSI
-        var_event, queue_event, psa_event, sma_event, shift = running_variance(queue_event, psa_event, sma_event, rssi[k])
+    for k, value in enumerate(numpy.asarray(rssi).tolist()):
+        # Update the moving average of RSSI
+        shift = stats_event.update(value)
         # Calculate the output of the filter
-        diff = -(sma_event-sma_base) - r*math.sqrt(var_base)
+        diff = -(stats_event.mean-stats_base.mean) - r*math.sqrt(var_base)
         result.append(diff)
         # Update the baseline if no event occured
         if k < (wbase+winstant) or diff < 0:
-            var_base, queue_base, psa_base, sma_base, unused = running_variance(queue_base, psa_base, sma_base, shift)
+            stats_base.update(shift)
+            var_base = stats_base.variance()
     return result
 
 
@@ -229,70 +350,102 @@ def baseline_filter(time, rssi, data):
     winstant = int(data_fields[1])
     r = float(data_fields[2])
 
-    psa_base = 0
-    sma_base = 0
-    psa_event = 0
-    sma_event = 0
-
-    queue_base = [0] * wbase
-    queue_event = [0] * winstant
+    stats_base = RunningStats(wbase)
+    stats_event = RunningStats(winstant)
 
     var_base = 10000
 
     result = []
-    for k in xrange(len(rssi)):
-        # Update the moving variances of RSSI
-        var_event, queue_event, psa_event, sma_event, shift = running_variance(queue_event, psa_event, sma_event, rssi[k])
+    for k, value in enumerate(numpy.asarray(rssi).tolist()):
+        # Update the moving average of RSSI
+        shift = stats_event.update(value)
         # Calculate the output of the filter
-        diff = -(sma_event-sma_base) - r*math.sqrt(var_base)
-        result.append(sma_base)
+        diff = -(stats_event.mean-stats_base.mean) - r*math.sqrt(var_base)
+        result.append(stats_base.mean)
         # Update the baseline if no event occured
         if k < (wbase+winstant) or diff < 0:
-            var_base, queue_base, psa_base, sma_base, unused = running_variance(queue_base, psa_base, sma_base, shift)
+            stats_base.update(shift)
+            var_base = stats_base.variance()
     return result
 
 
-
-def running_variance(queue, psa, sma, new):
-    # See http://stackoverflow.com/questions/5147378/rolling-variance-algorithm
-    # Update the estimated variance
-    old = queue[0]
-    n = len(queue)
-    psa += (new**2 - old**2) / float(n)
-    sma += (new - old) / float(n)
-    var = psa - sma**2
-    # Shift the queue
-    queue = queue[1:] + [new]
-    # Return the results
-    return max(0.0, var), queue, psa, sma, old
-
-
 def windowed_minimum_detector(time, rssi, data):
     data_fields = data.split(',')
     window_size = float(data_fields[0])
     threshold = float(data_fields[1])
-    window = []
+    window = MonotonicQueue() # The last accepted values
 
     result = []
-    for value in rssi:
-        if len(window) < window_size or value > min(window) - threshold:
-            window.append(value)
-            if len(window)>window_size:
-                window.pop(0)
-        result.append(min(window) - threshold - value)
+    for value in numpy.asarray(rssi).tolist():
+        if len(window) < window_size or value > window.extremum() - threshold:
+            window.push(value)
+            if len(window) > window_size:
+                window.pop()
+        result.append(window.extremum() - threshold - value)
 
     return result
 
 
+class SlidingHistogram(object):
+    """
+    Histogram of the integer values in a sliding window. RSSI values are int8 (see rssi_binary), so the counts are
+    kept in a fixed array with a bin for every int8 value.
+    """
+    def __init__(self):
+        self.counts = [0] * 256
+        self.total = 0
+
+    def push(self, value):
+        if not -128 <= value < 128:
+            raise ValueError("RSSI value {} out of range.".format(value))
+        self.counts[value + 128] += 1
+        self.total += 1
+
+    def pop(self, value):
+        # Remove a value that was pushed before
+        self.counts[value + 128] -= 1
+        self.total -= 1
+
+    def probability(self, value):
+        if self.total == 0:
+            return float('NaN')
+        return float(self.counts[value + 128]) / self.total
+
+
 def histogram_probability(time, rssi, data):
+    # Data: window size in samples
+    # Result: relative frequency of every RSSI value among the last window size values
     window_size = int(data)
+    values = numpy.asarray(rssi).astype(int).tolist()
+
+    histogram = SlidingHistogram()
+    result = []
+    for k, value in enumerate(values):
+        histogram.push(value)
+        if k >= window_size:
+            histogram.pop(values[k-window_size])
+        result.append(histogram.probability(value))
+    return result
+
+
+def moving_histogram(time, rssi, data):
+    # Data: window in seconds
+    # Result: relative frequency of every RSSI value in the time window around it, like the other moving_* filters
+    window = datetime.timedelta(seconds=float(data)) # Window in seconds
+    window_start, window_end = window_bounds(time, window)
+    values = numpy.asarray(rssi).astype(int).tolist()
 
+    histogram = SlidingHistogram()
+    start = end = 0
     result = []
-    for k in xrange(len(rssi)):
-        start = max(0, k+1-window_size)
-        cnt = Counter(int(i) for i in rssi[start:k+1])
-        p = float(cnt[int(rssi[k])]) / (k+1-start)
-        result.append(p)
+    for value, next_start, next_end in zip(values, window_start, window_end):
+        while end < next_end:
+            histogram.push(values[end])
+            end += 1
+        while start < next_start:
+            histogram.pop(values[start])
+            start += 1
+        result.append(histogram.probability(value))
     return result
 
 
@@ -313,5 +466,6 @@ filter_table = {
     "windowed_average": windowed_average_detector,
     "windowed_minimum": windowed_minimum_detector,
     "histogram": histogram_probability,
+    "moving_histogram": moving_histogram,
     "baseline": baseline_filter,
 }
\ No newline at end of file
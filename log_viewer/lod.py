@@ -0,0 +1,87 @@
+# Level of detail for plotting long RSSI logs.
+#
+# A Pyramid holds the minimum, maximum and mean of a series in fixed-width x buckets at several resolutions. Every
+# level has buckets that are factor times wider than the level below, starting at a few samples per bucket. When
+# the plot is zoomed or panned, select() returns the coarsest level that still has about one bucket per pixel, or
+# the raw samples once there are few enough of them in view. The x values are plain floats (e.g. matplotlib date
+# numbers) in increasing order, NaN y values are ignored.
+
+import numpy
+
+
+class Level(object):
+    # Buckets of one resolution, only non-empty buckets are stored
+    def __init__(self, width, index, minimum, maximum, total, count):
+        self.width = width
+        self.index = index # Bucket number, the bucket covers [x0 + index*width, x0 + (index+1)*width)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.total = total
+        self.count = count
+
+
+class Pyramid(object):
+    """
+    Min/max/mean pyramid of a series.
+    """
+    def __init__(self, x, y, factor=4, samples_per_bucket=4, min_buckets=256):
+        """
+        :param x: increasing x values
+        :param y: y values
+        :param factor: number of buckets of a level that make up one bucket of the next level
+        :param samples_per_bucket: average number of samples in a bucket of the finest level
+        :param min_buckets: stop adding levels when a level has fewer buckets than this
+        """
+        self.x = numpy.asarray(x, dtype=float)
+        self.y = numpy.asarray(y, dtype=float)
+        self.levels = []
+        if len(self.x) < 2 or not self.x[-1] > self.x[0]:
+            return
+        self.x0 = self.x[0]
+        width = (self.x[-1] - self.x0) / len(self.x) * samples_per_bucket
+        valid = ~numpy.isnan(self.y)
+        level = self.aggregate(width, ((self.x - self.x0) // width).astype(numpy.int64),
+                               numpy.where(valid, self.y, numpy.inf), numpy.where(valid, self.y, -numpy.inf),
+                               numpy.where(valid, self.y, 0.0), valid.astype(numpy.int64))
+        self.levels.append(level)
+        while len(level.index) >= min_buckets:
+            level = self.aggregate(level.width * factor, level.index // factor, level.minimum, level.maximum,
+                                   level.total, level.count)
+            self.levels.append(level)
+
+    @staticmethod
+    def aggregate(width, index, minimum, maximum, total, count):
+        # Combine consecutive entries with the same bucket index
+        starts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(index)) + 1])
+        return Level(width, index[starts], numpy.minimum.reduceat(minimum, starts),
+                     numpy.maximum.reduceat(maximum, starts), numpy.add.reduceat(total, starts),
+                     numpy.add.reduceat(count, starts))
+
+    def select(self, xmin, xmax, pixels, mode="minmax", skip=1):
+        """
+        :param xmin, xmax: visible x range
+        :param pixels: width of the plot in pixels
+        :param mode: "minmax" for the minimum and maximum of every bucket (both at the bucket center), "mean" for
+            the mean of every bucket
+        :param skip: only use every skip'th raw sample
+        :return: (x, y) arrays to plot, including one point beyond both ends of the range
+        """
+        start = max(0, numpy.searchsorted(self.x, xmin) - 1)
+        end = numpy.searchsorted(self.x, xmax) + 1
+        resolution = (xmax - xmin) / max(1.0, pixels)
+        levels = [level for level in self.levels if level.width <= resolution]
+        if end - start <= 2 * pixels or not levels:
+            return self.x[start:end:skip], self.y[start:end:skip]
+
+        level = levels[-1]
+        first = max(0, numpy.searchsorted(level.index, (xmin - self.x0) // level.width) - 1)
+        last = numpy.searchsorted(level.index, (xmax - self.x0) // level.width) + 2
+        index = level.index[first:last]
+        count = level.count[first:last]
+        center = self.x0 + (index + 0.5) * level.width
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            if mode == "mean":
+                return center, numpy.where(count > 0, level.total[first:last] / count, numpy.nan)
+            minimum = numpy.where(count > 0, level.minimum[first:last], numpy.nan)
+            maximum = numpy.where(count > 0, level.maximum[first:last], numpy.nan)
+        return numpy.repeat(center, 2), numpy.column_stack([minimum, maximum]).ravel()
@@ -0,0 +1,103 @@
+# Cache of parsed RSSI logs, see parseLog.
+#
+# Every cache entry is a directory named after a hash of the log file path, size and modification time and
+# of the parse arguments (device filter, time range), so entries become unused as soon as the log changes.
+# The samples of all devices are stored as consecutive blocks in timestamp.npy and rssi.npy, which are
+# memory-mapped when the entry is loaded. The cache directory is kept below a maximum size by removing
+# the least recently used entries.
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "rssi_log_viewer")
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024 # bytes
+
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+
+
+def cache_key(filename, device_filter, start_time, end_time):
+    stat = os.stat(filename)
+    key = repr((CACHE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime,
+                device_filter.lower() if device_filter else None, str(start_time), str(end_time)))
+    return hashlib.sha1(key).hexdigest()
+
+
+def load(directory, key):
+    """
+    :return: the cached RSSI log (see parseLog) with memory-mapped arrays, or None if it is not cached
+    """
+    path = os.path.join(directory, key)
+    try:
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        timestamp = numpy.load(os.path.join(path, "timestamp.npy"), mmap_mode="r")
+        rssi = numpy.load(os.path.join(path, "rssi.npy"), mmap_mode="r")
+    except (IOError, OSError, ValueError):
+        return None
+    os.utime(path, None) # Mark as recently used
+    rssi_log = {"addresses": set()}
+    for address, begin, end in index["devices"]:
+        address = str(address)
+        rssi_log["addresses"].add(address)
+        rssi_log[address] = {"timestamp": timestamp[begin:end], "rssi": rssi[begin:end]}
+    return rssi_log
+
+
+def store(directory, key, rssi_log, max_size=DEFAULT_MAX_SIZE):
+    # Add a parsed RSSI log to the cache and remove old entries if the cache becomes too large
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    addresses = sorted(rssi_log["addresses"])
+    devices = []
+    begin = 0
+    for address in addresses:
+        end = begin + len(rssi_log[address]["timestamp"])
+        devices.append((address, begin, end))
+        begin = end
+    timestamp = numpy.concatenate([rssi_log[address]["timestamp"] for address in addresses] or
+                                  [numpy.array([], dtype="datetime64[us]")])
+    rssi = numpy.concatenate([rssi_log[address]["rssi"] for address in addresses] or [numpy.array([], dtype=int)])
+
+    # Write to a temporary directory first, so incomplete entries are never loaded
+    path = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+    try:
+        numpy.save(os.path.join(path, "timestamp.npy"), timestamp)
+        numpy.save(os.path.join(path, "rssi.npy"), rssi)
+        with open(os.path.join(path, INDEX_FILE), 'w') as f:
+            json.dump({"devices": devices}, f)
+        os.rename(path, os.path.join(directory, key))
+    except OSError:
+        # Another process stored the same entry in the meantime
+        shutil.rmtree(path, ignore_errors=True)
+    evict(directory, max_size)
+
+
+def _entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def evict(directory, max_size):
+    # Remove the least recently used entries until the cache is smaller than max_size bytes
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(".tmp-") or not os.path.isdir(path):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), _entry_size(path), path))
+        except OSError:
+            continue
+    entries.sort()
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in entries:
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
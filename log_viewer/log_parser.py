@@ -1,57 +1,319 @@
 import zipfile
 import sys
+import os
 import datetime
+import multiprocessing
 
-def parseLog(filename, device_filter=None, start_time=datetime.datetime(2015,1,1), end_time=datetime.datetime(2050,1,1)):
+import numpy
+
+import rssi_binary
+import log_cache
+
+
+def parse_rssi_text(data, adapter=False):
+    # Parse the contents of a .rssi text file, yields (timestamp, address, rssi) tuples. Lines may have a fourth
+    # column with the receiving adapter (see RssiWriter), which is ignored unless adapter is True: then
+    # (timestamp, address, rssi, adapter) tuples are yielded, with adapter None for lines without the column.
+    for line in data.splitlines():
+        field = line.split('\t')
+        try:
+            time = datetime.datetime.strptime(field[0], "%Y-%m-%d %H:%M:%S.%f")
+        except:
+            time = datetime.datetime.strptime(field[0], "%Y-%m-%d %H:%M:%S")
+        if adapter:
+            yield time, field[1], int(field[2]), int(field[3]) if len(field) > 3 else None
+        else:
+            yield time, field[1], int(field[2])
+
+
+# Hourly log files are named after the hour in which they were started (%Y%m%d-%H.rssi). Records close
+# to the hour boundary may end up in the neighbouring file, so files are selected with some slack.
+MEMBER_DURATION = datetime.timedelta(hours=1)
+MEMBER_SLACK = datetime.timedelta(minutes=1)
+
+
+def index_members(zf):
+    """
+    :param zf: log ZipFile
+    :return: [(hour, name), ...] for all .rssi and .rssib files sorted by name, hour is None for files that
+        are not named after an hour
+    """
+    index = []
+    for name in sorted(zf.namelist()):
+        if not (name.endswith(".rssi") or name.endswith(rssi_binary.EXTENSION)):
+            continue
+        try:
+            hour = datetime.datetime.strptime(os.path.basename(name)[:11], "%Y%m%d-%H")
+        except ValueError:
+            hour = None
+        index.append((hour, name))
+    return index
+
+
+def select_members(index, start_time, end_time):
+    # Names of the indexed files that may contain records between start_time and end_time
+    return [name for hour, name in index if hour is None or
+            (hour - MEMBER_SLACK <= end_time and hour + MEMBER_DURATION + MEMBER_SLACK >= start_time)]
+
+
+def _bisect(lo, hi, predicate):
+    # First k in [lo, hi) for which predicate(k) is true, assuming predicate is monotonic
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def text_time_range(data, start_time, end_time):
+    """
+    Find the lines of a .rssi file between start_time and end_time without parsing the file. Relies on the
+    lines being written in time order (up to MEMBER_SLACK), timestamps are compared as strings.
+    :return: (begin, end) offsets of the lines in data, which may include some lines outside the range
+    """
+    start_key = str(start_time - MEMBER_SLACK)
+    end_key = str(end_time + MEMBER_SLACK)
+    line_starts = numpy.concatenate([[0], numpy.flatnonzero(numpy.frombuffer(data, dtype="S1") == "\n") + 1])
+    if line_starts[-1] == len(data):
+        line_starts = line_starts[:-1]
+    lines = len(line_starts)
+
+    def timestamp(k):
+        start = line_starts[k]
+        end = data.find('\t', start, start + 32)
+        return data[start:end] if end != -1 else data[start:start + 26]
+
+    first = _bisect(0, lines, lambda k: timestamp(k) >= start_key)
+    last = _bisect(first, lines, lambda k: timestamp(k) > end_key)
+    begin = line_starts[first] if first < lines else len(data)
+    end = line_starts[last] if last < lines else len(data)
+    return begin, end
+
+
+def parse_rssi_text_bulk(data):
+    """
+    Parse the contents of a .rssi text file at once with numpy.
+    :return: (timestamps, addresses, rssi) arrays, timestamps are datetime64[us]
+    :raises ValueError: when the file contains malformed lines, use parse_rssi_text instead
+    """
+    # Files have three or four (with the adapter) columns, see parse_rssi_text
+    line_end = data.find('\n')
+    columns = data.count('\t', 0, line_end if line_end >= 0 else len(data)) + 1 if data else 3
+    if columns not in (3, 4):
+        raise ValueError("Malformed RSSI log.")
+    fields = data.replace('\n', '\t').split('\t')
+    if fields[-1] == '':
+        fields.pop()
+    if len(fields) % columns != 0:
+        raise ValueError("Malformed RSSI log.")
+    # datetime64 parses both the "%Y-%m-%d %H:%M:%S.%f" and "%Y-%m-%d %H:%M:%S" formats
+    timestamps = numpy.array(fields[0::columns]).astype("datetime64[us]")
+    addresses = numpy.array(fields[1::columns], dtype=str)
+    rssi = numpy.array(fields[2::columns]).astype(int)
+    incomplete = sum(1 for field in fields[0::columns] if len(field) == 19)
+    if incomplete:
+        print "(Found {} incomplete timestamps)".format(incomplete)
+    return timestamps, addresses, rssi
+
+
+def _parse_rssi_text_columns(data):
+    try:
+        return parse_rssi_text_bulk(data)
+    except ValueError:
+        print "(Malformed lines found, parsing line by line)"
+        records = [record for record in parse_rssi_text_lenient(data)]
+        return (numpy.array([record[0] for record in records], dtype="datetime64[us]"),
+                numpy.array([record[1] for record in records], dtype=str),
+                numpy.array([record[2] for record in records], dtype=int))
+
+
+def parse_rssi_text_lenient(data, adapter=False):
+    # Like parse_rssi_text, but skips lines that cannot be parsed
+    for line in data.splitlines():
+        try:
+            record = next(parse_rssi_text(line, adapter))
+        except (ValueError, IndexError, StopIteration):
+            print "(Skipping malformed line '{}')".format(line)
+            continue
+        yield record
+
+
+def parse_rssi_binary(f, start_time=None, end_time=None):
+    # Parse a .rssib file object, yields (timestamps, addresses, rssi) arrays per chunk. Chunks that are
+    # completely outside the time range are skipped without decoding them.
+    for chunk in rssi_binary.read_chunks(f, start_time, end_time):
+        addresses = numpy.array(chunk.addresses, dtype=str)
+        yield chunk.time.view("datetime64[us]"), addresses[chunk.device], chunk.rssi.astype(int)
+
+
+def parseLog(filename, device_filter=None, start_time=datetime.datetime(2015,1,1), end_time=datetime.datetime(2050,1,1),
+             cache_dir=None, cache_size=log_cache.DEFAULT_MAX_SIZE, jobs=1, exit_on_empty=True):
     """
-    :param filename: path to zipfile containing .rssi files
+    :param filename: path to zipfile containing .rssi (text) or .rssib (binary) files
     :param device_filter: if specified, only parse results from this device
     :param start_time: (datetime) ignore entries before this time
     :param end_time: (datetime) ignore entries after this time
+    :param cache_dir: if specified, cache the parsed log in this directory (see log_cache.py)
+    :param cache_size: (bytes) maximum size of the cache directory
+    :param jobs: number of processes used to parse the .rssi files in parallel
+    :param exit_on_empty: exit when no devices were found, otherwise the empty log is returned
     :return: RSSI log: {
         ["addresses"]: set(address, address, ...)
         ["<address>"]:
-            ["timestamp"]: [timestamp, timestamp, ...]
-            ["rssi"]: [rssi, rssi, ...] }
+            ["timestamp"]: numpy datetime64[us] array
+            ["rssi"]: numpy int array }
     """
+    rssi_log = None
+    if cache_dir:
+        key = log_cache.cache_key(filename, device_filter, start_time, end_time)
+        rssi_log = log_cache.load(cache_dir, key)
+        if rssi_log is not None:
+            print "Loaded {} from cache.".format(filename)
+    if rssi_log is None:
+        rssi_log = _read_log(filename, device_filter, start_time, end_time, jobs)
+        if cache_dir:
+            log_cache.store(cache_dir, key, rssi_log, cache_size)
+
+    print "The following addresses were detected:"
+    for address in rssi_log["addresses"]:
+        print address
+    if len(rssi_log["addresses"]) == 0:
+        print "No devices were found."
+        if exit_on_empty:
+            sys.exit(0)
+
+    return rssi_log
+
+
+def _read_log(filename, device_filter, start_time, end_time, jobs=1):
     # Open the log file
     print "Reading from {}...".format(filename)
     zf = zipfile.ZipFile(filename)
 
-    # Get the .rssi filenames
-    rssi_filenames = [name for name in zf.namelist() if name.endswith(".rssi")]
-    rssi_filenames.sort()
+    # Get the .rssi filenames, skip the files outside the time range
+    index = index_members(zf)
+    rssi_filenames = select_members(index, start_time, end_time)
     print "RSSI logs found:"
-    for name in rssi_filenames:
-        print name
+    for hour, name in index:
+        print name if name in rssi_filenames else "{} (skipped)".format(name)
 
     # Import RSSI data
-    print "Importing data, this can take a while..."
+    if jobs > 1 and len(rssi_filenames) > 1:
+        print "Importing data using {} processes...".format(jobs)
+        pool = multiprocessing.Pool(min(jobs, len(rssi_filenames)))
+        try:
+            # Results are returned in the order of the files, which makes the output identical to the serial path
+            parts = pool.map(_read_member_job, [(filename, name, device_filter, start_time, end_time)
+                                                for name in rssi_filenames], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        print "Importing data..."
+        parts = [_collect(iterLog(filename, device_filter, start_time, end_time, names=rssi_filenames))]
+    return _merge(parts)
+
+
+def _collect(chunks):
+    # Concatenate the chunks of iterLog into {address: (timestamps, rssi)}
+    collected = {}
+    for address, timestamps, rssi in chunks:
+        collected.setdefault(address, ([], []))
+        collected[address][0].append(timestamps)
+        collected[address][1].append(rssi)
+    return dict((address, (numpy.concatenate(timestamps), numpy.concatenate(rssi)))
+                for address, (timestamps, rssi) in collected.iteritems())
+
+
+def _merge(parts):
+    # Merge consecutive {address: (timestamps, rssi)} parts into an RSSI log
     rssi_log = {"addresses": set()}
-    for name in rssi_filenames:
-        for line in zf.read(name).splitlines():
-            field = line.split('\t')
-            if device_filter and field[1].lower() != device_filter.lower():
-                continue
-            try:
-                time = datetime.datetime.strptime(field[0], "%Y-%m-%d %H:%M:%S.%f")
-            except:
-                time = datetime.datetime.strptime(field[0], "%Y-%m-%d %H:%M:%S")
-                print "(Found incomplete timestamp at {})".format(time)
-            if time >= start_time and time <= end_time:
-                if not field[1] in rssi_log["addresses"]:
-                    rssi_log["addresses"].add(field[1])
-                    rssi_log[field[1]] = {"timestamp": [], "rssi": []}
-                rssi_log[field[1]]["timestamp"].append(time)
-                rssi_log[field[1]]["rssi"].append(int(field[2]))
-            elif time > end_time:
-                break
+    addresses = set(address for part in parts for address in part)
+    for address in addresses:
+        rssi_log["addresses"].add(address)
+        rssi_log[address] = {"timestamp": numpy.concatenate([part[address][0] for part in parts if address in part]),
+                             "rssi": numpy.concatenate([part[address][1] for part in parts if address in part])}
+    return rssi_log
+
+
+def iterLog(filename, device_filter=None, start_time=datetime.datetime(2015,1,1), end_time=datetime.datetime(2050,1,1),
+            chunk_size=65536, names=None, block_size=1024*1024):
+    """
+    Stream the RSSI data of a log in bounded memory.
+    :param filename: path to zipfile containing .rssi (text) or .rssib (binary) files
+    :param device_filter: if specified, only return results from this device
+    :param start_time: (datetime) ignore entries before this time
+    :param end_time: (datetime) ignore entries after this time
+    :param chunk_size: number of samples per chunk, only the last chunk of a device can be shorter
+    :param names: files to read (default: all files that overlap the time range)
+    :param block_size: (bytes) amount of text that is parsed at once
+    :return: generator of (address, timestamps, rssi) chunks, the chunks of a device are in time order and
+        contain numpy arrays as in parseLog
+    """
+    zf = zipfile.ZipFile(filename)
+    if names is None:
+        names = select_members(index_members(zf), start_time, end_time)
+
+    buffers = {} # address: ([timestamps, ...], [rssi, ...], samples)
+    for name in names:
+        for timestamps, addresses, rssi in _iter_member(zf, name, device_filter, start_time, end_time, block_size):
+            for address in numpy.unique(addresses):
+                selected = addresses == address
+                address_timestamps, address_rssi, samples = buffers.get(address, ([], [], 0))
+                address_timestamps.append(timestamps[selected])
+                address_rssi.append(rssi[selected])
+                samples += len(address_timestamps[-1])
+                if samples >= chunk_size:
+                    address_timestamps = [numpy.concatenate(address_timestamps)]
+                    address_rssi = [numpy.concatenate(address_rssi)]
+                    while samples >= chunk_size:
+                        yield address, address_timestamps[0][:chunk_size], address_rssi[0][:chunk_size]
+                        address_timestamps = [address_timestamps[0][chunk_size:]]
+                        address_rssi = [address_rssi[0][chunk_size:]]
+                        samples -= chunk_size
+                buffers[address] = (address_timestamps, address_rssi, samples)
+    for address, (address_timestamps, address_rssi, samples) in sorted(buffers.iteritems()):
+        if samples > 0:
+            yield address, numpy.concatenate(address_timestamps), numpy.concatenate(address_rssi)
+
+
+def _iter_member(zf, name, device_filter, start_time, end_time, block_size):
+    # Stream a single .rssi or .rssib file, yields the selected (timestamps, addresses, rssi) columns per block
+    if name.endswith(rssi_binary.EXTENSION):
+        for columns in parse_rssi_binary(zf.open(name), start_time, end_time):
+            yield _select(columns, device_filter, start_time, end_time)
+        return
+    f = zf.open(name)
+    remainder = ""
+    while True:
+        block = f.read(block_size)
+        data = remainder + block
+        if block:
+            # Only parse complete lines
+            cut = data.rfind('\n') + 1
+            data, remainder = data[:cut], data[cut:]
+        if data:
+            begin, end = text_time_range(data, start_time, end_time)
+            if begin < end:
+                yield _select(_parse_rssi_text_columns(data[begin:end]), device_filter, start_time, end_time)
+            if end < len(data):
+                return # Past end_time
+        if not block:
+            return
+
+
+def _read_member_job(arguments):
+    # Process pool entry point, every worker opens the zip file itself
+    filename, name, device_filter, start_time, end_time = arguments
+    return _collect(iterLog(filename, device_filter, start_time, end_time, names=[name]))
 
-    print "The following addresses were detected:"
-    for address in rssi_log["addresses"]:
-        print address
-    if len(rssi_log["addresses"]) == 0:
-        print "No devices were found."
-        sys.exit(0)
 
-    return rssi_log
\ No newline at end of file
+def _select(columns, device_filter, start_time, end_time):
+    # Select the records from the device within the time range
+    timestamps, addresses, rssi = columns
+    selected = (timestamps >= numpy.datetime64(start_time, "us")) & (timestamps <= numpy.datetime64(end_time, "us"))
+    if device_filter:
+        selected &= numpy.char.lower(addresses) == device_filter.lower()
+    return timestamps[selected], addresses[selected], rssi[selected]
@@ -3,23 +3,31 @@ import zipfile
 import datetime
 import matplotlib.pyplot as plt
 import matplotlib.dates as pltdates
+from matplotlib.collections import BrokenBarHCollection
 import numpy
 
 from log_parser import parseLog
+import log_cache
 from filters import filter_table
-from show_image import show_image
+from events import find_events, event_intervals, write_events
+from lod import Pyramid
 
 # Read command line arguments
 parser = argparse.ArgumentParser(description="View bluetooth rssi log.")
 
 parser.add_argument("input_file", help="log .zip file containing the RSSI data and webcam images")
-parser.add_argument("--skip", type=int, default=1, help="number of samples to skip while plotting")
+parser.add_argument("--skip", type=int, default=1, help="number of samples to skip while plotting raw samples (zoomed in)")
 parser.add_argument("--start", default="2016-01-01 00:00:00", help="skip entries before this time ('YYYY-MM-DD HH:MM:SS')")
 parser.add_argument("--end", default="2050-01-01 00:00:00", help="skip entries after this time ('YYYY-MM-DD HH:MM:SS')")
 parser.add_argument("--filter", default=None, help="filter to post-process data, see filters.py")
 parser.add_argument("--filterdata", default="", help="additional data for the filter")
 parser.add_argument("--device", default=None, help="only show results for this device address")
 parser.add_argument("--event", action="store_true", help="highglight events when the filtered value is larger than 0")
+parser.add_argument("--events-out", default=None, help="write the events (start, end, address, duration, peak) to this CSV file")
+parser.add_argument("--jobs", type=int, default=1, help="number of processes used to parse the log")
+parser.add_argument("--cache-dir", default=log_cache.DEFAULT_DIRECTORY, help="directory to cache parsed logs in")
+parser.add_argument("--cache-size", type=int, default=log_cache.DEFAULT_MAX_SIZE/(1024*1024), help="maximum size of the cache directory in MB")
+parser.add_argument("--no-cache", action="store_true", help="do not use the cache of parsed logs")
 args = parser.parse_args()
 
 input_name = args.input_file
@@ -39,7 +47,26 @@ if args.filter:
 
 
 # Import/parse
-rssi_log = parseLog(input_name, device_filter=device_filter, start_time=start_time, end_time=end_time)
+rssi_log = parseLog(input_name, device_filter=device_filter, start_time=start_time, end_time=end_time,
+                    cache_dir=None if args.no_cache else args.cache_dir, cache_size=args.cache_size*1024*1024, jobs=args.jobs)
+for address in rssi_log["addresses"]:
+    # Plotting uses matplotlib date numbers
+    rssi_log[address]["datenum"] = pltdates.epoch2num(rssi_log[address]["timestamp"].astype(numpy.int64) / 1e6)
+
+# Long logs are plotted from a min/max/mean pyramid with about one bucket per pixel, which is re-sampled when the
+# plot is zoomed or panned (see lod.py)
+lod_lines = []
+def plot_lod(x, y, *args, **kwargs):
+    pyramid = Pyramid(x, y)
+    xmin, xmax = (x[0], x[-1]) if len(x) else (0.0, 1.0)
+    line, = plt.plot(*(pyramid.select(xmin, xmax, plt.gca().bbox.width, skip=skip) + args), **kwargs)
+    lod_lines.append((line, pyramid))
+
+def update_lod(axes):
+    xmin, xmax = axes.get_xlim()
+    for line, pyramid in lod_lines:
+        line.set_data(*pyramid.select(xmin, xmax, axes.bbox.width, skip=skip))
+    axes.figure.canvas.draw_idle()
 
 # Show raw RSSI values
 print "Plotting..."
@@ -48,12 +75,13 @@ plt.xlabel("Time")
 plt.ylabel("RSS [dBm]")
 
 for address in rssi_log["addresses"]:
-    plt.plot(rssi_log[address]["timestamp"][::skip], rssi_log[address]["rssi"][::skip], ".", alpha=0.5)
+    plot_lod(rssi_log[address]["datenum"], rssi_log[address]["rssi"], ".", alpha=0.5)
     plt.hold(True)
     print '{} median: {}, mean: {} dBm, variance: {} dB^2.'.format(address, numpy.median(rssi_log[address]["rssi"]), numpy.mean(rssi_log[address]["rssi"]), numpy.var(rssi_log[address]["rssi"]))
 plt.grid()
 plt.legend(rssi_log["addresses"])
 ax = plt.gca()
+ax.xaxis_date()
 ax.xaxis.set_major_formatter(pltdates.DateFormatter("%H:%M:%S"))
 plt.draw()
 
@@ -64,31 +92,46 @@ if filter_fn:
     plt.gca().set_color_cycle(None) # Reset color cycle so filtered data appears in the correct color
     for address in rssi_log["addresses"]:
         rssi_log[address]["filtered"] = filter_fn(rssi_log[address]["timestamp"], rssi_log[address]["rssi"], filter_data)
-        plt.plot(rssi_log[address]["timestamp"][::skip], rssi_log[address]["filtered"][::skip])
+        plot_lod(rssi_log[address]["datenum"], rssi_log[address]["filtered"])
     plt.draw()
 
-# Show detected events if required
-if show_events:
+# Show detected events if required, as one collection of spans over the full height of the plot per device
+if show_events and filter_fn:
     for address in rssi_log["addresses"]:
-        event_start = -1
-        for k in xrange(len(rssi_log[address]["filtered"])):
-            if rssi_log[address]["filtered"][k] > 0 and event_start == -1:
-                event_start = k
-            elif rssi_log[address]["filtered"][k] <= 0 and event_start != -1:
-                # Event found
-                plt.axvspan(rssi_log[address]["timestamp"][event_start], rssi_log[address]["timestamp"][k], color='r', alpha=0.5, lw=0)
-                event_start = -1
+        datenum = rssi_log[address]["datenum"]
+        spans = [(datenum[event_start], datenum[event_end] - datenum[event_start])
+                 for event_start, event_end in find_events(rssi_log[address]["filtered"])]
+        ax.add_collection(BrokenBarHCollection(spans, (0, 1), transform=ax.get_xaxis_transform(), facecolor='r',
+                                               alpha=0.5, lw=0), autolim=False)
+    plt.draw()
 
+# Export detected events if required
+if args.events_out and filter_fn:
+    write_events(args.events_out, dict((address, event_intervals(rssi_log[address]["timestamp"], rssi_log[address]["filtered"]))
+                                       for address in rssi_log["addresses"]))
+    print "Events written to {}.".format(args.events_out)
 
-# Add a click event handler which will show the webcam image from a specified time
+
+# Add a mouse event handler which will show the webcam image from a specified time. Mouse movements are
+# coalesced: the image is updated from a timer with the latest position only.
 zf = zipfile.ZipFile(input_name)
+pending_xdata = [None]
 def onclick(event):
     if event.xdata:
-        time = pltdates.num2date(event.xdata)
-        print "Retrieve image from {}...".format(time)
+        pending_xdata[0] = event.xdata
+
+def show_pending_image():
+    if pending_xdata[0] is not None:
+        time = pltdates.num2date(pending_xdata[0])
+        pending_xdata[0] = None
+        from show_image import show_image # Imports pygame, only when an image is needed
         show_image(zf, time)
 
 fig.canvas.mpl_connect("motion_notify_event", onclick)
+ax.callbacks.connect("xlim_changed", update_lod)
+image_timer = fig.canvas.new_timer(interval=50)
+image_timer.add_callback(show_pending_image)
+image_timer.start()
 
 # Wait until the user closes the window
 print "Done. Click on the plot to retrieve webcam images. Close the plot to end"
@@ -0,0 +1,140 @@
+# Playback engine for the webcam images in a log .zip file.
+#
+# A decoder thread reads and scales the upcoming frames into a bounded buffer, so decoding hiccups do not
+# stall the display. Playback runs at a configurable speed. When more frames are due per second than
+# max_fps, the decoder skips frames. Seeking restarts the decoder at the new position, the zip file is
+# never reopened.
+
+import math
+import time
+import datetime
+import threading
+import Queue
+from io import BytesIO
+
+import pygame
+
+
+class Player(object):
+    """
+    Plays the frames of a show_image.FrameIndex.
+    """
+    def __init__(self, zipfile, index, resolution, start_time, speed=1.0, max_fps=10.0, prefetch=16):
+        """
+        :param zipfile: log ZipFile, only read by the decoder thread
+        :param index: FrameIndex of the zip file
+        :param resolution: size of the decoded frames
+        :param start_time: (datetime) start of playback
+        :param speed: playback speed multiplier
+        :param max_fps: maximum number of frames decoded per second of playback
+        :param prefetch: number of decoded frames that are buffered
+        """
+        self.zipfile = zipfile
+        self.index = index
+        self.resolution = resolution
+        self.max_fps = max_fps
+        self.buffer = Queue.Queue(prefetch)
+        self.lock = threading.Lock()
+        self.paused = False
+        self.speed = speed
+        self.generation = 0 # Incremented on every seek, frames decoded for older generations are discarded
+        self.position = 0 # Next frame to decode
+        self.pending = None # Decoded frame that is not due yet
+        self.stopping = False
+        self.seek(start_time)
+        self.decoder = threading.Thread(target=self.decode_frames, name="decoder")
+        self.decoder.daemon = True
+        self.decoder.start()
+
+    # Playback clock
+    def time(self):
+        # Current playback time
+        if self.paused:
+            return self.clock_time
+        return self.clock_time + datetime.timedelta(seconds=(time.time() - self.clock_wall)*self.speed)
+
+    def rebase(self, playback_time):
+        self.clock_time = playback_time
+        self.clock_wall = time.time()
+
+    def set_speed(self, speed):
+        self.rebase(self.time())
+        self.speed = speed
+
+    def toggle_pause(self):
+        self.rebase(self.time())
+        self.paused = not self.paused
+
+    def seek(self, timestamp):
+        k = self.index.nearest(timestamp)
+        with self.lock:
+            self.generation += 1
+            self.position = k if k is not None else len(self.index)
+            self.pending = None
+            # Drop the frames decoded for the old position
+            while True:
+                try:
+                    self.buffer.get_nowait()
+                except Queue.Empty:
+                    break
+        self.rebase(timestamp.replace(tzinfo=None))
+
+    def jump(self, seconds):
+        self.seek(self.time() + datetime.timedelta(seconds=seconds))
+
+    # Frames
+    def step(self):
+        # Number of frames to advance, frames are recorded once per second
+        return max(1, int(math.ceil(self.speed / self.max_fps)))
+
+    def decode_frames(self):
+        while not self.stopping:
+            with self.lock:
+                generation = self.generation
+                k = self.position
+            if k >= len(self.index):
+                time.sleep(0.05)
+                continue
+            name = self.index.names[k]
+            try:
+                image = pygame.image.load(BytesIO(self.zipfile.read(name)))
+                frame = (generation, self.index.time(k), name, pygame.transform.scale(image, self.resolution))
+            except Exception:
+                print "Can't decode '{}'.".format(name)
+                frame = None
+            with self.lock:
+                if generation != self.generation:
+                    continue
+                self.position = k + self.step()
+            while frame and not self.stopping and generation == self.generation:
+                try:
+                    self.buffer.put(frame, timeout=0.05)
+                    break
+                except Queue.Full:
+                    pass
+
+    def next_frame(self):
+        """
+        :return: (timestamp, name, surface) of the latest frame that is due, None if no new frame is due.
+            Frames that became due while the display was busy are skipped.
+        """
+        now = self.time()
+        due = None
+        while True:
+            if self.pending is None:
+                try:
+                    self.pending = self.buffer.get_nowait()
+                except Queue.Empty:
+                    break
+                if self.pending[0] != self.generation:
+                    self.pending = None
+                    continue
+            if self.pending[1] > now:
+                break
+            due = self.pending[1:]
+            self.pending = None
+        return due
+
+    def close(self):
+        self.stopping = True
+        self.decoder.join()
@@ -1,22 +1,101 @@
 # Helper function to extract and show images from a .zip log file
 from io import BytesIO
+from collections import OrderedDict
+import bisect
+import datetime
+import os
 import pygame
-import sys
 
 resolution = (640,480)
-screen = pygame.display.set_mode(resolution)
+screen = None # The display is opened when the first image is shown, see get_screen()
+
+IMAGE_FORMAT = "%Y%m%d-%H.%M.%S.jpg"
+
+
+def get_screen():
+    # Open the display on first use, so importing this module does not need a display
+    global screen
+    if screen is None:
+        pygame.init()
+        screen = pygame.display.set_mode(resolution)
+    return screen
+
+
+class FrameIndex(object):
+    """
+    Index of the webcam images in a log .zip file. The image names (IMAGE_FORMAT) sort in time order, so the
+    index is a sorted list of names that is searched with bisect.
+    """
+    def __init__(self, zipfile):
+        frames = sorted((os.path.basename(name), name) for name in zipfile.namelist()
+                        if name.endswith(".jpg") and len(os.path.basename(name)) == len("20160101-00.00.00.jpg"))
+        self.keys = [key for key, name in frames]
+        self.names = [name for key, name in frames]
+
+    def __len__(self):
+        return len(self.names)
+
+    def time(self, k):
+        return datetime.datetime.strptime(self.keys[k], IMAGE_FORMAT)
+
+    def nearest(self, timestamp):
+        """
+        :return: index of the image closest to timestamp, None if there are no images
+        """
+        if not self.names:
+            return None
+        timestamp = timestamp.replace(tzinfo=None)
+        k = bisect.bisect_left(self.keys, timestamp.strftime(IMAGE_FORMAT))
+        if k == len(self.keys):
+            return k - 1
+        if k > 0 and timestamp - self.time(k-1) < self.time(k) - timestamp:
+            return k - 1
+        return k
+
+
+class ImageViewer(object):
+    """
+    Shows the webcam images of a log .zip file. Decoded and scaled images are kept in an LRU cache.
+    """
+    def __init__(self, zipfile, cache_size=32):
+        self.zipfile = zipfile
+        self.index = FrameIndex(zipfile)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.current = None
+
+    def load(self, name):
+        image = self.cache.pop(name, None)
+        if image is None:
+            image = pygame.transform.scale(pygame.image.load(BytesIO(self.zipfile.read(name))), resolution)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[name] = image
+        return image
+
+    def show(self, timestamp):
+        k = self.index.nearest(timestamp)
+        if k is None:
+            print "No images found."
+            return
+        filename = self.index.names[k]
+        if filename == self.current:
+            return
+        self.current = filename
+        screen = get_screen()
+        pygame.display.set_caption(os.path.basename(filename))
+        print "Opening image '{}'...".format(filename)
+        try:
+            screen.blit(self.load(filename), (0,0))
+            pygame.display.flip()
+        except Exception:
+            print "Can open '{}'.".format(filename)
+
+
+_viewers = {}
 
 def show_image(zipfile, timestamp):
-    # extract the image from the zip file
-    filename_list = zipfile.namelist()
-    filename = timestamp.strftime("%Y%m%d-%H.%M.%S.jpg")
-    pygame.display.set_caption(filename)
-    filename = next(name for name in filename_list if name.endswith(filename))
-    print "Opening image '{}'...".format(filename)
-    try:
-        img_data = zipfile.read(filename)
-        image = pygame.image.load(BytesIO(img_data))
-        screen.blit(pygame.transform.scale(image, resolution), (0,0))
-        pygame.display.flip()
-    except Exception:
-        print "Can open '{}'.".format(filename)
\ No newline at end of file
+    # Show the image closest to timestamp
+    if zipfile not in _viewers:
+        _viewers[zipfile] = ImageViewer(zipfile)
+    _viewers[zipfile].show(timestamp)
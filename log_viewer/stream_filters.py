@@ -0,0 +1,450 @@
+# Streaming counterparts of the filters in filters.py, for online detection while recording (see
+# bluetooth_cam_logger/detector.py).
+#
+# A stream filter is created with the same data string as its batch version and is fed one sample at a time.
+# update(time, rssi) returns a list of (time, value) outputs that became final with that sample, flush() returns
+# the remaining outputs at the end of the stream. Together they are equal to the output of the batch filter for
+# the same samples. Causal filters return the output of every sample immediately. Filters with a centered time
+# window (moving_average etc.) return the output of a sample once a sample half a window later has come in.
+
+import math
+import datetime
+from collections import deque
+
+import numpy
+
+from filters import MonotonicQueue, RunningStats, SlidingHistogram, timedelta_microseconds
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_microseconds(time):
+    return timedelta_microseconds(time - EPOCH)
+
+
+class StreamFilter(object):
+    def update(self, time, rssi):
+        """
+        :param time: (datetime) timestamp of the sample, samples should be in time order
+        :param rssi: RSSI value of the sample
+        :return: [(time, value), ...] outputs that are final
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        # Outputs of the samples that are still waiting for their window to complete
+        return []
+
+
+class CausalFilter(StreamFilter):
+    # Filter that has the output of every sample as soon as it comes in
+    def update(self, time, rssi):
+        return [(time, self.step(rssi))]
+
+
+class Template(CausalFilter):
+    def __init__(self, data):
+        pass
+
+    def step(self, rssi):
+        return rssi
+
+
+class Difference(CausalFilter):
+    def __init__(self, data):
+        self.last = None
+
+    def step(self, rssi):
+        last, self.last = self.last, rssi
+        if last is None:
+            return 0.0
+        return rssi - last
+
+
+class Wang2013(Difference):
+    def __init__(self, data):
+        Difference.__init__(self, data)
+        self.sigma = float(data)
+
+    def step(self, rssi):
+        return -2*self.sigma - Difference.step(self, rssi)
+
+
+# Centered time windows
+class WindowSums(object):
+    # Count, sum and sum of squares of the values in a window, exact for integer values
+    def __init__(self):
+        self.count = 0
+        self.s1 = 0
+        self.s2 = 0
+
+    def push(self, value):
+        self.count += 1
+        self.s1 += value
+        self.s2 += value*value
+
+    def pop(self, value):
+        self.count -= 1
+        self.s1 -= value
+        self.s2 -= value*value
+
+    def average(self):
+        if self.count == 0:
+            return float('NaN')
+        return float(self.s1) / self.count
+
+    def variance(self):
+        # Same rounding as filters.sliced_variance
+        if self.count == 0:
+            return float('NaN')
+        return max(float(self.count*self.s2 - self.s1*self.s1), 0.0) / float(self.count*self.count)
+
+
+class WindowExtrema(object):
+    # Minimum and maximum of the values in a window
+    def __init__(self):
+        self.minimum = MonotonicQueue()
+        self.maximum = MonotonicQueue(maximum=True)
+
+    def push(self, value):
+        self.minimum.push(value)
+        self.maximum.push(value)
+
+    def pop(self, value):
+        self.minimum.pop()
+        self.maximum.pop()
+
+
+class Window(object):
+    # Window of +/- window/2 around a sample (see filters.window_bounds) and the aggregate of the values inside.
+    # The values are taken shift samples after the window bounds.
+    def __init__(self, window, aggregate, shift=0):
+        self.half = timedelta_microseconds(window) // 2
+        self.shift = shift
+        self.start = 0
+        self.end = 0
+        self.aggregate = aggregate
+
+
+class CenteredWindowFilter(StreamFilter):
+    """
+    Filter over one or more centered time windows. The output of a sample is final once a sample at least half the
+    largest window later has come in, or when the stream is flushed.
+    """
+    def __init__(self, windows):
+        self.windows = windows
+        self.delay = max(window.half for window in windows)
+        self.lookahead = max(window.shift for window in windows)
+        self.samples = [] # (time in us, time, rssi) from the start of the oldest window
+        self.offset = 0 # Index of samples[0] in the stream
+        self.count = 0 # Number of samples received
+        self.pending = 0 # Index of the oldest sample without output
+
+    def sample(self, k):
+        return self.samples[k - self.offset]
+
+    def update(self, time, rssi):
+        t = to_microseconds(time)
+        self.samples.append((t, time, rssi))
+        self.count += 1
+        outputs = []
+        # The window ends are known when a sample after them has come in, plus lookahead samples for the values
+        latest = self.count - 1 - self.lookahead
+        while self.pending <= latest and self.sample(latest)[0] >= self.sample(self.pending)[0] + self.delay:
+            outputs.append(self.finalize(latest + 1))
+        self.trim()
+        return outputs
+
+    def flush(self):
+        # The window ends never include the last sample, like in filters.window_bounds
+        outputs = []
+        while self.pending < self.count:
+            outputs.append(self.finalize(self.count - 1))
+        self.trim()
+        return outputs
+
+    def finalize(self, end_limit):
+        t, time, rssi = self.sample(self.pending)
+        for window in self.windows:
+            while window.end < end_limit and self.sample(window.end)[0] < t + window.half:
+                window.aggregate.push(self.sample(window.end + window.shift)[2])
+                window.end += 1
+            while window.start < window.end and self.sample(window.start)[0] < t - window.half:
+                window.aggregate.pop(self.sample(window.start + window.shift)[2])
+                window.start += 1
+        self.pending += 1
+        return time, self.value(rssi, *[window.aggregate for window in self.windows])
+
+    def trim(self):
+        # Forget the samples that are no longer in any window
+        first = min([self.pending] + [window.start for window in self.windows])
+        if first - self.offset > len(self.samples) // 2:
+            del self.samples[:first - self.offset]
+            self.offset = first
+
+
+def _window(data):
+    return datetime.timedelta(seconds=float(data)) # Window in seconds
+
+
+class MovingAverage(CenteredWindowFilter):
+    # Like filters.windowed_average, the averaged values are shifted one sample from the window
+    def __init__(self, data):
+        CenteredWindowFilter.__init__(self, [Window(_window(data), WindowSums(), shift=1)])
+
+    def value(self, rssi, sums):
+        return sums.average()
+
+
+class MovingVariance(CenteredWindowFilter):
+    def __init__(self, data):
+        CenteredWindowFilter.__init__(self, [Window(_window(data), WindowSums())])
+
+    def value(self, rssi, sums):
+        return sums.variance()
+
+
+class MovingMinimum(CenteredWindowFilter):
+    def __init__(self, data):
+        CenteredWindowFilter.__init__(self, [Window(_window(data), WindowExtrema())])
+
+    def value(self, rssi, extrema):
+        return extrema.minimum.extremum()
+
+
+class MovingEnvelope(CenteredWindowFilter):
+    def __init__(self, data):
+        CenteredWindowFilter.__init__(self, [Window(_window(data), WindowExtrema())])
+
+    def value(self, rssi, extrema):
+        return extrema.maximum.extremum() - extrema.minimum.extremum()
+
+
+class MovingAverageEvent(CenteredWindowFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        CenteredWindowFilter.__init__(self, [Window(_window(data_fields[0]), WindowSums(), shift=1),
+                                             Window(_window(data_fields[1]), WindowSums(), shift=1)])
+
+    def value(self, rssi, background, event):
+        return event.average() - background.average()
+
+
+class MovingHistogram(CenteredWindowFilter):
+    def __init__(self, data):
+        CenteredWindowFilter.__init__(self, [Window(_window(data), SlidingHistogram())])
+
+    def value(self, rssi, histogram):
+        return histogram.probability(int(rssi))
+
+
+# Causal windows
+class CausalMaEvent(StreamFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        self.window_background = timedelta_microseconds(_window(data_fields[0]))
+        self.window_event = timedelta_microseconds(_window(data_fields[1]))
+        self.samples = [] # (time in us, sum of the rssi values before the sample) from the background window start
+        self.offset = 0
+        self.count = 0
+        self.total = 0
+        self.event_start = 0
+        self.background_start = 0
+
+    def sample(self, k):
+        return self.samples[k - self.offset]
+
+    def update(self, time, rssi):
+        # Event window: [event_start, k), background window: [background_start, event_start), see filters.causal_ma_event
+        t = to_microseconds(time)
+        k = self.count
+        self.samples.append((t, self.total))
+        self.count += 1
+        self.total += rssi
+        while self.event_start < k and self.sample(self.event_start)[0] < t - self.window_event:
+            self.event_start += 1
+        event_start_time, event_start_sum = self.sample(self.event_start)
+        while self.background_start < self.event_start and \
+                self.sample(self.background_start)[0] < event_start_time - self.window_background:
+            self.background_start += 1
+        if self.background_start - self.offset > len(self.samples) // 2:
+            del self.samples[:self.background_start - self.offset]
+            self.offset = self.background_start
+
+        if not k > self.event_start > self.background_start:
+            return [(time, 0.0)]
+        event = (float(self.sample(k)[1]) - float(event_start_sum)) / (k - self.event_start)
+        background = (float(event_start_sum) - float(self.sample(self.background_start)[1])) / \
+                     (self.event_start - self.background_start)
+        return [(time, min(0.0, event - background))]
+
+
+class Youssef2007a(CausalFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        self.wl = int(data_fields[0])
+        self.ws = int(data_fields[1])
+        self.tau = float(data_fields[2])
+        print "Youssef2007a moving average filter. wl = {}, ws = {}, tau = {}.".format(self.wl, self.ws, self.tau)
+        self.cumsum = deque(maxlen=self.wl+self.ws) # Running sums up to and including the last wl+ws samples
+        self.total = 0
+
+    def step(self, rssi):
+        self.total += rssi
+        self.cumsum.append(self.total)
+        if len(self.cumsum) < self.wl + self.ws:
+            return False
+        wl, ws, cumsum = self.wl, self.ws, self.cumsum
+        alk = numpy.float64(1/float(wl) * (cumsum[wl-1] - cumsum[0]))
+        ask = numpy.float64(1/float(ws) * (cumsum[wl+ws-1] - cumsum[wl]))
+        return abs((alk-ask)/alk) - self.tau
+
+
+class Youssef2007b(CausalFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        self.w = int(data_fields[0])
+        self.vtbar = float(data_fields[1])
+        self.sigmav = float(data_fields[2])
+        self.r = float(data_fields[3])
+        self.window = deque(maxlen=self.w)
+
+    def step(self, rssi):
+        self.window.append(rssi)
+        if len(self.window) < self.w:
+            return 0.0
+        vt = numpy.var(numpy.array(self.window)[:self.w-1])
+        return vt - self.vtbar - self.r*self.sigmav
+
+
+class Youssef2007bTraining(CausalFilter):
+    def __init__(self, data):
+        self.w = int(data)
+        self.window = deque(maxlen=self.w)
+        self.vt = []
+
+    def step(self, rssi):
+        self.window.append(rssi)
+        if len(self.window) == self.w:
+            self.vt.append(numpy.var(numpy.array(self.window)[:self.w-1]))
+        return rssi
+
+    def flush(self):
+        print "Training results:\n vtbar = {}, sigmav = {}.".format(numpy.mean(self.vt), numpy.std(self.vt))
+        return []
+
+
+class WindowedVariance(CausalFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        wbase = int(data_fields[0])
+        winstant = int(data_fields[1])
+        self.r = float(data_fields[2])
+        self.std_min = float(data_fields[3])
+        self.stats_base = RunningStats(winstant)
+        self.stats_var = RunningStats(wbase)
+        self.stats_event = RunningStats(winstant)
+
+    def step(self, rssi):
+        shift = self.stats_event.update(rssi)
+        self.stats_base.update(shift)
+        self.stats_var.update(self.stats_base.variance())
+        return self.stats_event.variance() - self.stats_var.mean - \
+            self.r*max(self.std_min, math.sqrt(self.stats_var.variance()))
+
+
+class WindowedAverage(CausalFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        self.wbase = int(data_fields[0])
+        self.winstant = int(data_fields[1])
+        self.r = float(data_fields[2])
+        self.stats_base = RunningStats(self.wbase)
+        self.stats_event = RunningStats(self.winstant)
+        self.var_base = 10000
+        self.count = 0
+
+    def step(self, rssi):
+        shift = self.stats_event.update(rssi)
+        diff = -(self.stats_event.mean-self.stats_base.mean) - self.r*math.sqrt(self.var_base)
+        output = self.output(diff)
+        # Update the baseline if no event occured
+        if self.count < (self.wbase+self.winstant) or diff < 0:
+            self.stats_base.update(shift)
+            self.var_base = self.stats_base.variance()
+        self.count += 1
+        return output
+
+    def output(self, diff):
+        return diff
+
+
+class Baseline(WindowedAverage):
+    def output(self, diff):
+        return self.stats_base.mean
+
+
+class WindowedMinimum(CausalFilter):
+    def __init__(self, data):
+        data_fields = data.split(',')
+        self.window_size = float(data_fields[0])
+        self.threshold = float(data_fields[1])
+        self.window = MonotonicQueue() # The last accepted values
+
+    def step(self, rssi):
+        window = self.window
+        if len(window) < self.window_size or rssi > window.extremum() - self.threshold:
+            window.push(rssi)
+            if len(window) > self.window_size:
+                window.pop()
+        return window.extremum() - self.threshold - rssi
+
+
+class HistogramProbability(CausalFilter):
+    def __init__(self, data):
+        self.window_size = int(data)
+        self.window = deque()
+        self.histogram = SlidingHistogram()
+
+    def step(self, rssi):
+        rssi = int(rssi)
+        self.window.append(rssi)
+        self.histogram.push(rssi)
+        if len(self.window) > self.window_size:
+            self.histogram.pop(self.window.popleft())
+        return self.histogram.probability(rssi)
+
+
+stream_filter_table = {
+    "default": Template,
+    "difference": Difference,
+    "moving_average": MovingAverage,
+    "moving_minimum": MovingMinimum,
+    "moving_envelope": MovingEnvelope,
+    "moving_variance": MovingVariance,
+    "moving_average_event": MovingAverageEvent,
+    "causal_ma_event": CausalMaEvent,
+    "wang2013": Wang2013,
+    "youssef2007a": Youssef2007a,
+    "youssef2007b": Youssef2007b,
+    "youssef2007b_training": Youssef2007bTraining,
+    "windowed_variance": WindowedVariance,
+    "windowed_average": WindowedAverage,
+    "windowed_minimum": WindowedMinimum,
+    "histogram": HistogramProbability,
+    "moving_histogram": MovingHistogram,
+    "baseline": Baseline,
+}
+
+
+def run_stream(stream, time, rssi):
+    """
+    Feed complete time and rssi lists through a stream filter.
+    :return: output values, like the batch filter
+    """
+    times = numpy.asarray(time, dtype="datetime64[us]").astype(datetime.datetime)
+    outputs = []
+    for sample_time, value in zip(times, numpy.asarray(rssi).tolist()):
+        outputs.extend(stream.update(sample_time, value))
+    outputs.extend(stream.flush())
+    return [value for output_time, value in outputs]
@@ -0,0 +1,116 @@
+# Parameter sweep for the filters in filters.py.
+#
+# The log is parsed once, after which every combination of filter parameters in the grid is evaluated in a pool of
+# worker processes. The workers are forked after parsing, so they share the parsed arrays with this process instead
+# of receiving copies. The events detected by every parameter combination (see events.py) are scored against a
+# file of labelled events and the results are written to a CSV file, best F1 score first.
+#
+# Grid: the --filterdata fields of the filter, alternatives for a field are separated by '|'. For example
+# "--filter windowed_variance --grid 100|200,10|20,3,1" evaluates four combinations. Pass --filter and --grid
+# more than once to sweep several filters.
+
+import argparse
+import csv
+import datetime
+import itertools
+import multiprocessing
+import sys
+
+from log_parser import parseLog
+import log_cache
+import events
+from filters import filter_table
+
+# Read command line arguments
+parser = argparse.ArgumentParser(description="Evaluate a grid of filter parameters against labelled events.")
+parser.add_argument("input_file", help="log .zip file containing the RSSI data")
+parser.add_argument("labels", help="CSV file with labelled events (start,end[,address]), see events.py")
+parser.add_argument("--filter", action="append", required=True, help="filter to evaluate, see filters.py")
+parser.add_argument("--grid", action="append", required=True, help="filter data grid for the preceding --filter, e.g. '100|200,10|20,3,1'")
+parser.add_argument("--output", default="sweep.csv", help="CSV file for the ranked results")
+parser.add_argument("--start", default="2016-01-01 00:00:00", help="skip entries before this time ('YYYY-MM-DD HH:MM:SS')")
+parser.add_argument("--end", default="2050-01-01 00:00:00", help="skip entries after this time ('YYYY-MM-DD HH:MM:SS')")
+parser.add_argument("--device", default=None, help="only evaluate this device address")
+parser.add_argument("--tolerance", type=float, default=0.0, help="seconds a detection may be before or after a label")
+parser.add_argument("--top", type=int, default=10, help="number of results to print")
+parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+parser.add_argument("--cache-dir", default=log_cache.DEFAULT_DIRECTORY, help="directory to cache parsed logs in")
+parser.add_argument("--no-cache", action="store_true", help="do not use the cache of parsed logs")
+args = parser.parse_args()
+
+if len(args.filter) != len(args.grid):
+    print "Error: every --filter needs a --grid."
+    sys.exit(1)
+for filter_name in args.filter:
+    if filter_name not in filter_table:
+        print "Error: can't find filter function '{}'.".format(filter_name)
+        sys.exit(1)
+
+start_time = datetime.datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S")
+end_time = datetime.datetime.strptime(args.end, "%Y-%m-%d %H:%M:%S")
+tolerance = datetime.timedelta(seconds=args.tolerance)
+
+
+def expand_grid(grid):
+    # All filter data strings in a grid specification
+    fields = [field.split('|') for field in grid.split(',')]
+    return [",".join(combination) for combination in itertools.product(*fields)]
+
+tasks = [(filter_name, data) for filter_name, grid in zip(args.filter, args.grid) for data in expand_grid(grid)]
+
+labels = events.read_labels(args.labels)
+if not labels:
+    print "Error: no labelled events in '{}'.".format(args.labels)
+    sys.exit(1)
+print "Read {} labelled events.".format(len(labels))
+
+# Shared with the worker processes
+rssi_log = parseLog(args.input_file, device_filter=args.device, start_time=start_time, end_time=end_time,
+                    cache_dir=None if args.no_cache else args.cache_dir)
+addresses = sorted(rssi_log["addresses"])
+
+
+def evaluate(task):
+    filter_name, data = task
+    detections = {}
+    try:
+        for address in addresses:
+            timestamp = rssi_log[address]["timestamp"]
+            filtered = filter_table[filter_name](timestamp, rssi_log[address]["rssi"], data)
+            detections[address] = [(timestamp[start].astype(datetime.datetime), timestamp[end].astype(datetime.datetime))
+                                   for start, end in events.find_events(filtered)]
+    except Exception as e:
+        print "Filter {} ({}) failed: {}".format(filter_name, data, e)
+        return filter_name, data, None
+    return filter_name, data, events.score(detections, labels, tolerance)
+
+
+print "Evaluating {} parameter combinations...".format(len(tasks))
+if args.jobs > 1:
+    pool = multiprocessing.Pool(args.jobs)
+    results = pool.map(evaluate, tasks, chunksize=1)
+    pool.close()
+    pool.join()
+else:
+    results = map(evaluate, tasks)
+
+# Rank by F1 score, then precision, then latency
+results = [(filter_name, data, score) for filter_name, data, score in results if score is not None]
+results.sort(key=lambda result: (-result[2]["f1"], -result[2]["precision"],
+                                 result[2]["latency"] if result[2]["latency"] is not None else float('inf')))
+
+columns = ["rank", "filter", "filterdata", "f1", "precision", "recall", "latency", "detections"]
+with open(args.output, 'wb') as f:
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    for rank, (filter_name, data, score) in enumerate(results, 1):
+        writer.writerow([rank, filter_name, data] + [score[column] if score[column] is not None else ""
+                                                     for column in columns[3:]])
+print "Results written to {}.".format(args.output)
+
+print "{:>4} {:<20} {:<24} {:>6} {:>9} {:>6} {:>9}".format("rank", "filter", "filterdata", "f1", "precision",
+                                                            "recall", "latency")
+for rank, (filter_name, data, score) in enumerate(results[:args.top], 1):
+    latency = "{:.1f} s".format(score["latency"]) if score["latency"] is not None else "-"
+    print "{:>4} {:<20} {:<24} {:>6.3f} {:>9.3f} {:>6.3f} {:>9}".format(rank, filter_name, data, score["f1"],
+                                                                        score["precision"], score["recall"], latency)
@@ -0,0 +1,96 @@
+# Synthetic RSSI logs for benchmarks of the filters and the log parser.
+#
+# A trace is Gaussian noise around a mean RSSI, sampled at a given rate with irregular intervals, with injected
+# attenuation events (e.g. a person blocking the line of sight). Logs can be written as log .zip files in the
+# text or binary format, like bluetooth_cam_logger writes them.
+
+import os
+import zipfile
+import datetime
+from io import BytesIO
+
+import numpy
+
+import rssi_binary
+
+DEFAULT_START_TIME = datetime.datetime(2016, 1, 1)
+
+
+def generate_trace(duration, rate=10.0, mean=-60.0, noise=2.0, events=0, event_duration=30.0, event_depth=15.0,
+                   jitter=0.5, start_time=DEFAULT_START_TIME, random=None):
+    """
+    :param duration: (s) length of the trace
+    :param rate: average number of samples per second
+    :param mean: (dBm) RSSI without events
+    :param noise: (dB) standard deviation of the RSSI
+    :param events: number of attenuation events, placed at random times
+    :param event_duration: (s) length of an event
+    :param event_depth: (dB) attenuation during an event
+    :param jitter: sample intervals vary uniformly by this fraction of 1/rate (0 for regular samples)
+    :param start_time: (datetime) time of the first sample
+    :param random: numpy RandomState, for repeatable traces
+    :return: (timestamp, rssi, events): datetime64[us] array, int array and [(start, end), ...] event datetimes
+    """
+    if random is None:
+        random = numpy.random.RandomState()
+    count = int(duration * rate)
+    intervals = (1.0 + jitter * random.uniform(-1.0, 1.0, count)) * 1e6 / rate
+    offsets = numpy.cumsum(intervals).astype(numpy.int64)
+    timestamp = numpy.datetime64(start_time, "us") + offsets.astype("timedelta64[us]")
+
+    rssi = mean + noise * random.standard_normal(count)
+    event_times = []
+    for event_start in sorted(random.uniform(0.0, max(0.0, duration - event_duration), events)):
+        start = numpy.datetime64(start_time, "us") + numpy.timedelta64(int(event_start * 1e6), "us")
+        end = start + numpy.timedelta64(int(event_duration * 1e6), "us")
+        rssi[(timestamp >= start) & (timestamp < end)] -= event_depth
+        event_times.append((start.astype(datetime.datetime), end.astype(datetime.datetime)))
+    rssi = numpy.clip(numpy.round(rssi), -128, 127).astype(int)
+    return timestamp, rssi, event_times
+
+
+def generate_log(duration, devices=5, random=None, **kwargs):
+    """
+    Generate a trace for several devices, see generate_trace for the other arguments.
+    :return: RSSI log like parseLog returns it
+    """
+    if random is None:
+        random = numpy.random.RandomState()
+    rssi_log = {"addresses": set()}
+    for k in xrange(devices):
+        address = "00:11:22:33:44:{:02x}".format(k)
+        timestamp, rssi, unused = generate_trace(duration, random=random, **kwargs)
+        rssi_log["addresses"].add(address)
+        rssi_log[address] = {"timestamp": timestamp, "rssi": rssi}
+    return rssi_log
+
+
+def write_log_zip(filename, rssi_log, binary=False):
+    # Write a log .zip file with hourly .rssi or .rssib files of the interleaved records of all devices
+    addresses = sorted(rssi_log["addresses"])
+    timestamp = numpy.concatenate([rssi_log[address]["timestamp"] for address in addresses])
+    rssi = numpy.concatenate([rssi_log[address]["rssi"] for address in addresses])
+    device = numpy.concatenate([numpy.full(len(rssi_log[address]["rssi"]), k) for k, address in enumerate(addresses)])
+    order = numpy.argsort(timestamp, kind="mergesort")
+    timestamp, rssi, device = timestamp[order], rssi[order], device[order]
+    hours = timestamp.astype("datetime64[h]")
+
+    zf = zipfile.ZipFile(filename, 'w', allowZip64=True)
+    for hour in numpy.unique(hours):
+        selected = hours == hour
+        name = os.path.join("log", hour.astype(datetime.datetime).strftime("%Y%m%d-%H"))
+        if binary:
+            output = BytesIO()
+            packed = [rssi_binary.string_to_address(address) for address in addresses]
+            writer = rssi_binary.ChunkWriter(output, flags=0)
+            times = timestamp[selected].astype(numpy.int64)
+            for start in xrange(0, len(times), 65536):
+                writer.write_chunk(times[start:start+65536].tolist(),
+                                   [packed[k] for k in device[selected][start:start+65536]],
+                                   rssi[selected][start:start+65536].tolist())
+            zf.writestr(name + rssi_binary.EXTENSION, output.getvalue())
+        else:
+            lines = ["{}\t{}\t{}\n".format(time, addresses[k], value) for time, k, value in
+                     zip(timestamp[selected].astype(datetime.datetime), device[selected], rssi[selected])]
+            zf.writestr(name + ".rssi", "".join(lines))
+    zf.close()
@@ -17,9 +17,16 @@ DEBUG = False
 
 import os
 import sys
+import time
+import select
 import struct
-import bluetooth._bluetooth as bluez
+from collections import namedtuple
+try:
+    import bluetooth._bluetooth as bluez
+except ImportError:
+    bluez = None # Without pybluez only fake sockets can be used, see fakehci.py
 
+HCI_EVENT_PKT = 0x04
 LE_META_EVENT = 0x3e
 LE_PUBLIC_ADDRESS=0x00
 LE_RANDOM_ADDRESS=0x01
@@ -75,6 +82,55 @@ def get_packed_bdaddr(bdaddr_string):
 def packed_bdaddr_to_string(bdaddr_packed):
     return ':'.join('%02x'%i for i in struct.unpack("<BBBBBB", bdaddr_packed[::-1]))
 
+class HciSocket(object):
+    """
+    HCI socket of a Bluetooth adapter. The scan functions and Scanner only use this interface, so they also work
+    with the fake sockets in fakehci.py.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def send_cmd(self, ogf, ocf, params):
+        bluez.hci_send_cmd(self.sock, ogf, ocf, params)
+
+    def get_filter(self):
+        return self.sock.getsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, 14)
+
+    def set_filter(self, flt):
+        self.sock.setsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, flt )
+
+    def set_event_filter(self):
+        # Receive all HCI events
+        flt = bluez.hci_filter_new()
+        bluez.hci_filter_all_events(flt)
+        bluez.hci_filter_set_ptype(flt, bluez.HCI_EVENT_PKT)
+        self.set_filter(flt)
+
+    def close(self):
+        self.sock.close()
+
+def _as_hci_socket(sock):
+    # Wrap raw bluez sockets (from bluez.hci_open_dev), so the functions below still accept them
+    return sock if hasattr(sock, "send_cmd") else HciSocket(sock)
+
+def open_socket(device):
+    """
+    :param device: adapter number (as in hci0), or a fake socket specification string (see fakehci.open_socket)
+    :return: HciSocket or fakehci.FakeHciSocket
+    """
+    if isinstance(device, basestring) and not device.isdigit():
+        import fakehci
+        return fakehci.open_socket(device)
+    if bluez is None:
+        raise ImportError("pybluez is required to access Bluetooth adapters.")
+    return HciSocket(bluez.hci_open_dev(int(device)))
+
 def hci_enable_le_scan(sock):
     hci_toggle_le_scan(sock, 0x01)
 
@@ -100,83 +156,147 @@ def hci_toggle_le_scan(sock, enable):
 #        if (hci_send_req(dd, &rq, to) < 0)
 #                return -1;
     cmd_pkt = struct.pack("<BB", enable, 0x00)
-    bluez.hci_send_cmd(sock, OGF_LE_CTL, OCF_LE_SET_SCAN_ENABLE, cmd_pkt)
+    _as_hci_socket(sock).send_cmd(OGF_LE_CTL, OCF_LE_SET_SCAN_ENABLE, cmd_pkt)
 
 
 def hci_le_set_scan_parameters(sock):
-    old_filter = sock.getsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, 14)
+    sock = _as_hci_socket(sock)
+    old_filter = sock.get_filter()
 
     SCAN_RANDOM = 0x01
     OWN_TYPE = SCAN_RANDOM
     SCAN_TYPE = 0x01
 
 
-    
-def parse_events(sock, loop_count=100):
-    old_filter = sock.getsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, 14)
-
-    # perform a device inquiry on bluetooth device #0
-    # The inquiry should last 8 * 1.28 = 10.24 seconds
-    # before the inquiry is performed, bluez should flush its cache of
-    # previously discovered devices
-    flt = bluez.hci_filter_new()
-    bluez.hci_filter_all_events(flt)
-    bluez.hci_filter_set_ptype(flt, bluez.HCI_EVENT_PKT)
-    sock.setsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, flt )
-    done = False
-    results = []
-    myFullList = []
-    for i in range(0, loop_count):
-        pkt = sock.recv(255)
-        ptype, event, plen = struct.unpack("BBB", pkt[:3])
-        #print "--------------" 
-        if event == bluez.EVT_INQUIRY_RESULT_WITH_RSSI:
-		i =0
-        elif event == bluez.EVT_NUM_COMP_PKTS:
-                i =0 
-        elif event == bluez.EVT_DISCONN_COMPLETE:
-                i =0 
-        elif event == LE_META_EVENT:
-            subevent, = struct.unpack("B", pkt[3])
-            pkt = pkt[4:]
-            if subevent == EVT_LE_CONN_COMPLETE:
-                le_handle_connection_complete(pkt)
-            elif subevent == EVT_LE_ADVERTISING_REPORT:
-                #print "advertising report"
-                num_reports = struct.unpack("B", pkt[0])[0]
-                report_pkt_offset = 0
-                for i in range(0, num_reports):
-		
-		    if (DEBUG == True):
-			print "-------------"
-                    	#print "\tfullpacket: ", printpacket(pkt)
-		    	print "\tUDID: ", printpacket(pkt[report_pkt_offset -22: report_pkt_offset - 6])
-		    	print "\tMAJOR: ", printpacket(pkt[report_pkt_offset -6: report_pkt_offset - 4])
-		    	print "\tMINOR: ", printpacket(pkt[report_pkt_offset -4: report_pkt_offset - 2])
-                    	print "\tMAC address: ", packed_bdaddr_to_string(pkt[report_pkt_offset + 3:report_pkt_offset + 9])
-		    	# commented out - don't know what this byte is.  It's NOT TXPower
-                    	txpower, = struct.unpack("b", pkt[report_pkt_offset -2])
-                    	print "\t(Unknown):", txpower
-	
-                    	rssi, = struct.unpack("b", pkt[report_pkt_offset -1])
-                    	print "\tRSSI:", rssi
-		    # build the return string
-                    Adstring = packed_bdaddr_to_string(pkt[report_pkt_offset + 3:report_pkt_offset + 9])
-		    Adstring += ","
-		    Adstring += returnstringpacket(pkt[report_pkt_offset -22: report_pkt_offset - 6]) 
-		    Adstring += ","
-		    Adstring += "%i" % returnnumberpacket(pkt[report_pkt_offset -6: report_pkt_offset - 4]) 
-		    Adstring += ","
-		    Adstring += "%i" % returnnumberpacket(pkt[report_pkt_offset -4: report_pkt_offset - 2]) 
-		    Adstring += ","
-		    Adstring += "%i" % struct.unpack("b", pkt[report_pkt_offset -2])
-		    Adstring += ","
-		    Adstring += "%i" % struct.unpack("b", pkt[report_pkt_offset -1])
-
-		    #print "\tAdstring=", Adstring
- 		    myFullList.append(Adstring)
-                done = True
-    sock.setsockopt( bluez.SOL_HCI, bluez.HCI_FILTER, old_filter )
-    return myFullList
 
+# Advertising reports are decoded into compact records instead of strings. The address is kept as the
+# packed 6-byte (little endian) string, compare it against get_packed_bdaddr() results to avoid formatting
+# every report. The iBeacon fields (uuid, major, minor, txpower) are None for adverts that are too short
+# to contain an iBeacon payload. The time is the (time.time()) receive time of the HCI packet. The adapter is the
+# number of the receiving adapter in the logger, when several adapters are scanned at the same time.
+AdvertisingReport = namedtuple("AdvertisingReport", ["address", "uuid", "major", "minor", "txpower", "rssi", "time",
+                                                     "adapter"])
+
+# Fixed layouts within a raw HCI event packet (ptype, event, plen, subevent, num_reports, reports...)
+_event_header = struct.Struct("<BBBBB")
+_report_header = struct.Struct("<BB6sB") # event type, address type, address, data length
+_ibeacon_tail = struct.Struct(">16sHHbb") # uuid, major, minor, txpower (last 21 data bytes) and rssi
+_rssi = struct.Struct("<b")
+_REPORTS_OFFSET = _event_header.size
 
+def decode_packet(pkt, timestamp=None, adapter=0):
+    """
+    Decode the LE advertising reports in a raw HCI event packet.
+    :param pkt: packet as returned by sock.recv()
+    :param timestamp: receive time, defaults to time.time()
+    :param adapter: number of the receiving adapter
+    :return: list of AdvertisingReports (empty for other events)
+    """
+    view = memoryview(pkt)
+    size = len(view)
+    if size < _REPORTS_OFFSET:
+        return []
+    ptype, event, plen, subevent, num_reports = _event_header.unpack_from(view)
+    if event != LE_META_EVENT or subevent != EVT_LE_ADVERTISING_REPORT:
+        return []
+    if timestamp is None:
+        timestamp = time.time()
+
+    reports = []
+    offset = _REPORTS_OFFSET
+    for i in xrange(num_reports):
+        if offset + _report_header.size >= size:
+            break
+        evt_type, addr_type, address, data_len = _report_header.unpack_from(view, offset)
+        rssi_offset = offset + _report_header.size + data_len
+        if rssi_offset >= size:
+            break
+        if data_len >= _ibeacon_tail.size - 1:
+            uuid, major, minor, txpower, rssi = _ibeacon_tail.unpack_from(view, rssi_offset - _ibeacon_tail.size + 1)
+        else:
+            uuid = major = minor = txpower = None
+            rssi, = _rssi.unpack_from(view, rssi_offset)
+        reports.append(AdvertisingReport(address, uuid, major, minor, txpower, rssi, timestamp, adapter))
+        offset = rssi_offset + 1
+    return reports
+
+def report_to_string(report):
+    # Format a report as the comma separated string returned by parse_events()
+    return "{},{},{},{},{},{}".format(packed_bdaddr_to_string(report.address),
+                                      report.uuid.encode("hex") if report.uuid is not None else "",
+                                      report.major or 0, report.minor or 0, report.txpower or 0, report.rssi)
+
+def print_report(report):
+    print "-------------"
+    print "\tUDID: ", report.uuid.encode("hex") if report.uuid is not None else "-"
+    print "\tMAJOR: ", report.major
+    print "\tMINOR: ", report.minor
+    print "\tMAC address: ", packed_bdaddr_to_string(report.address)
+    print "\t(Unknown):", report.txpower
+    print "\tRSSI:", report.rssi
+
+class Scanner(object):
+    """
+    Reads advertising reports from an HciSocket. The event filter is set up once when the scanner is
+    created and the previous filter is restored by close(). Reports are tagged with the adapter number.
+    """
+    def __init__(self, sock, adapter=0):
+        self.sock = sock = _as_hci_socket(sock)
+        self.adapter = adapter
+        self.old_filter = sock.get_filter()
+        sock.set_event_filter()
+
+    def close(self):
+        if self.old_filter is not None:
+            self.sock.set_filter(self.old_filter)
+            self.old_filter = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read_packet(self):
+        # Blocking read of a single HCI packet, returns the decoded reports
+        reports = decode_packet(self.sock.recv(255), adapter=self.adapter)
+        if DEBUG:
+            for report in reports:
+                print_report(report)
+        return reports
+
+    def reports(self, timeout=None, max_reports=None):
+        """
+        Yield AdvertisingReports until the timeout expires or max_reports reports were read.
+        :param timeout: (seconds) stop waiting for packets after this time, None blocks until max_reports
+        :param max_reports: stop after the packet that contains the max_reports'th report
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        count = 0
+        while max_reports is None or count < max_reports:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                readable, unused, unused = select.select([self.sock], [], [], remaining)
+                if not readable:
+                    return
+            for report in self.read_packet():
+                count += 1
+                yield report
+
+def read_reports(sock, loop_count=100):
+    """
+    Read loop_count HCI packets from sock and yield the decoded AdvertisingReports.
+    """
+    scanner = Scanner(sock)
+    try:
+        for i in xrange(loop_count):
+            for report in scanner.read_packet():
+                yield report
+    finally:
+        scanner.close()
+
+def parse_events(sock, loop_count=100):
+    # Compatibility wrapper, returns the reports as "address,uuid,major,minor,txpower,rssi" strings
+    return [report_to_string(report) for report in read_reports(sock, loop_count)]
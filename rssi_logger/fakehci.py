@@ -0,0 +1,268 @@
+# Fake HCI socket and camera, to run blescan, rssi_logger and bluetooth_cam_logger without hardware.
+#
+# A FakeHciSocket replays a schedule of raw HCI event packets: (time, packet) pairs, time in seconds from the
+# start of scanning. Packets can be generated (synthetic_packets, paced at a fixed rate and optionally in bursts)
+# or read from a recording of a real adapter (read_recording). A feeder process writes the packets into one end
+# of a SOCK_SEQPACKET socket pair, which keeps the packet boundaries like an HCI socket does, and the scanner
+# reads from the other end. Like the kernel does for a real adapter, packets are dropped (and counted) when the
+# reader falls behind and the socket buffer is full. The feeder runs in a separate process, so its CPU time is
+# not counted as CPU time of the scanner.
+#
+# Recordings are sequences of "<dH" (receive time, packet length) headers followed by the packet.
+#
+# Use open_socket() specifications as the Bluetooth device in the loggers (see blescan.open_socket):
+#   "fake[:rate=100,burst=1,reports=1,devices=5,count=0,ibeacon=1]" synthetic packets, count 0 is endless
+#   "replay:<recording>[,speed=1.0]" a recording, at its original timing divided by speed
+
+import time
+import errno
+import random
+import select
+import socket
+import struct
+import multiprocessing
+
+import blescan
+
+MAX_PACKET_SIZE = 255
+
+_record_header = struct.Struct("<dH")
+_event_header = struct.Struct("<BBBBB") # ptype, event, plen, subevent, num_reports
+_report_header = struct.Struct("<BB6sB") # event type, address type, address, data length
+
+IBEACON_PREFIX = "\x02\x01\x06\x1a\xff\x4c\x00\x02\x15" # Flags, Apple manufacturer data, iBeacon type and length
+DEFAULT_UUID = "\xe2\xc5\x6d\xb5\xdf\xfb\x48\xd2\xb0\x60\xd0\xf5\xa7\x10\x96\xe0"
+
+
+# Packets
+def encode_report(address, rssi, uuid=None, major=0, minor=0, txpower=-59, evt_type=blescan.ADV_NONCONN_IND):
+    """
+    :param address: packed address (see blescan.get_packed_bdaddr)
+    :param uuid: 16 byte iBeacon UUID, None for an advert without iBeacon payload
+    :return: advertising report as it appears in an LE meta event
+    """
+    if uuid is None:
+        data = "\x02\x01\x06"
+    else:
+        data = IBEACON_PREFIX + uuid + struct.pack(">HHb", major, minor, txpower)
+    return _report_header.pack(evt_type, blescan.LE_PUBLIC_ADDRESS, address, len(data)) + data + struct.pack("<b", rssi)
+
+
+def encode_packet(reports):
+    # HCI event packet with the encoded advertising reports
+    body = "".join(reports)
+    packet = _event_header.pack(blescan.HCI_EVENT_PKT, blescan.LE_META_EVENT, len(body) + 2,
+                                blescan.EVT_LE_ADVERTISING_REPORT, len(reports)) + body
+    if len(packet) > MAX_PACKET_SIZE:
+        raise ValueError("Too many reports for one HCI packet.")
+    return packet
+
+
+def synthetic_packets(devices=5, reports_per_packet=1, ibeacon=True, count=None, seed=None):
+    """
+    Generate packets with random RSSI values from the addresses 00:11:22:33:44:00, 00:11:22:33:44:01, ...
+    :param count: number of packets, None for an endless stream
+    """
+    generator = random.Random(seed)
+    addresses = [blescan.get_packed_bdaddr("00:11:22:33:44:{:02x}".format(k)) for k in xrange(devices)]
+    uuid = DEFAULT_UUID if ibeacon else None
+    k = 0
+    while count is None or k < count:
+        reports = []
+        for i in xrange(reports_per_packet):
+            device = generator.randrange(devices)
+            reports.append(encode_report(addresses[device], generator.randint(-100, -30), uuid, 1, device))
+        yield encode_packet(reports)
+        k += 1
+
+
+def paced(packets, rate, burst=1):
+    # Schedule packets at rate packets per second, in bursts of back-to-back packets
+    for k, packet in enumerate(packets):
+        yield (k // burst) * burst / float(rate), packet
+
+
+def packet_reports(packet):
+    return ord(packet[4]) if len(packet) > 4 else 0
+
+
+# Recordings
+def record_packets(sock, f, duration):
+    """
+    Record the HCI event packets received by sock.
+    :param sock: blescan.HciSocket with scanning enabled
+    :param f: output file object
+    :param duration: (seconds) recording time
+    :return: number of packets recorded
+    """
+    old_filter = sock.get_filter()
+    sock.set_event_filter()
+    count = 0
+    deadline = time.time() + duration
+    try:
+        while time.time() < deadline:
+            readable, unused, unused = select.select([sock], [], [], deadline - time.time())
+            if readable:
+                packet = sock.recv(MAX_PACKET_SIZE)
+                f.write(_record_header.pack(time.time(), len(packet)) + packet)
+                count += 1
+    finally:
+        sock.set_filter(old_filter)
+    return count
+
+
+def read_recording(f, speed=1.0):
+    # Schedule the packets of a recording at their original timing, divided by speed
+    start = None
+    while True:
+        header = f.read(_record_header.size)
+        if len(header) < _record_header.size:
+            return
+        receive_time, size = _record_header.unpack(header)
+        if start is None:
+            start = receive_time
+        yield (receive_time - start) / speed, f.read(size)
+
+
+# Socket
+class FakeHciSocket(object):
+    """
+    Stand-in for blescan.HciSocket that replays a schedule of packets once scanning is enabled.
+    """
+    def __init__(self, schedule, buffer_size=None):
+        """
+        :param schedule: iterable of (time, packet), see paced() and read_recording()
+        :param buffer_size: (bytes) socket send buffer size, the system default if None
+        """
+        self.schedule = schedule
+        self.sock, self.feeder_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        if buffer_size is not None:
+            self.feeder_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        self.sent_packets = multiprocessing.Value('L', 0)
+        self.sent_reports = multiprocessing.Value('L', 0)
+        self.dropped_packets = multiprocessing.Value('L', 0)
+        self.dropped_reports = multiprocessing.Value('L', 0)
+        self.commands = []
+        self.filter = None
+        self.feeder = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def send_cmd(self, ogf, ocf, params):
+        self.commands.append((ogf, ocf, params))
+        if ogf == blescan.OGF_LE_CTL and ocf == blescan.OCF_LE_SET_SCAN_ENABLE and params[:1] == "\x01":
+            self.start()
+
+    def get_filter(self):
+        return self.filter
+
+    def set_filter(self, flt):
+        self.filter = flt
+
+    def set_event_filter(self):
+        self.filter = "events"
+
+    def start(self):
+        # Start replaying the schedule
+        if self.feeder is not None:
+            return
+        self.feeder = multiprocessing.Process(target=self.feed, name="fake hci feeder")
+        self.feeder.daemon = True
+        self.feeder.start()
+        self.feeder_sock.close()
+
+    def feed(self):
+        self.sock.close()
+        self.feeder_sock.setblocking(False)
+        start = time.time()
+        try:
+            for packet_time, packet in self.schedule:
+                delay = start + packet_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    self.feeder_sock.send(packet)
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.ENOBUFS):
+                        raise
+                    # The reader fell behind
+                    self.dropped_packets.value += 1
+                    self.dropped_reports.value += packet_reports(packet)
+                    continue
+                self.sent_packets.value += 1
+                self.sent_reports.value += packet_reports(packet)
+        except socket.error as e:
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            self.feeder_sock.close()
+
+    def finished(self):
+        # True when the whole schedule has been sent
+        return self.feeder is not None and not self.feeder.is_alive()
+
+    def close(self):
+        if self.feeder is not None and self.feeder.is_alive():
+            self.feeder.terminate()
+            self.feeder.join()
+        self.sock.close()
+
+
+def open_socket(specification):
+    """
+    :param specification: "fake[:key=value,...]" or "replay:<recording>[,speed=...]", see the top of this file
+    :return: FakeHciSocket
+    """
+    kind, unused, options = specification.partition(':')
+    options = options.split(',') if options else []
+    if kind == "replay":
+        if not options:
+            raise ValueError("Missing recording in '{}'.".format(specification))
+        filename = options.pop(0)
+    settings = {}
+    for option in options:
+        key, unused, value = option.partition('=')
+        settings[key] = value
+    if kind == "replay":
+        return FakeHciSocket(read_recording(open(filename, 'rb'), float(settings.get("speed", 1.0))))
+    if kind != "fake":
+        raise ValueError("Unknown Bluetooth device '{}'.".format(specification))
+    count = int(settings.get("count", 0))
+    packets = synthetic_packets(devices=int(settings.get("devices", 5)), reports_per_packet=int(settings.get("reports", 1)),
+                                ibeacon=settings.get("ibeacon", "1") != "0", count=count or None)
+    return FakeHciSocket(paced(packets, float(settings.get("rate", 100.0)), int(settings.get("burst", 1))))
+
+
+# Camera
+class FakeCamera(object):
+    """
+    Stand-in for pygame.camera.Camera that returns generated images at a maximum frame rate.
+    """
+    def __init__(self, resolution, fps=30.0):
+        import pygame
+        self.pygame = pygame
+        self.resolution = resolution
+        self.interval = 1.0 / fps
+        self.last_time = 0.0
+        self.frames = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_image(self):
+        # Wait for the next frame like a real camera does
+        delay = self.last_time + self.interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.last_time = time.time()
+        self.frames += 1
+        image = self.pygame.Surface(self.resolution)
+        image.fill((self.frames % 256, 128, 255 - self.frames % 256))
+        return image
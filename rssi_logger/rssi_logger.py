@@ -2,7 +2,6 @@
 
 import blescan
 import sys
-import bluetooth._bluetooth as bluez
 import numpy
 
 import matplotlib.pyplot as plt
@@ -14,13 +13,10 @@ number_of_samples = -1
 
 if len(sys.argv) < 3:
 	print "Usage: rssi_logger.py <device id> <address> [<samples>]"
+	print "The device id is an adapter number, or a fake socket specification such as 'fake:rate=100' (see fakehci.py)."
 	sys.exit(1)
 
-try:
-	dev_id = int(sys.argv[1])
-except:
-	print "Invalid device id: '{}', should be an integer.".format(sys.argv[1])
-	sys.exit(1)
+dev_id = sys.argv[1]
 
 address = sys.argv[2]
 	
@@ -35,29 +31,33 @@ if len(sys.argv) >= 4:
 print "Scanning for '{}'...".format(address)
 
 try:
-	sock = bluez.hci_open_dev(dev_id)
+	sock = blescan.open_socket(dev_id)
 except:
-	print "Error accessing bluetooth device."
+	print "Error accessing bluetooth device '{}'.".format(dev_id)
 	sys.exit(1)
 
 blescan.hci_le_set_scan_parameters(sock)
 blescan.hci_enable_le_scan(sock)
+scanner = blescan.Scanner(sock)
 
+packed_address = blescan.get_packed_bdaddr(address)
 average = 0.0
 remaining = number_of_samples
 
 rssi_list = []
 
 while remaining != 0:
-	adv_list = blescan.parse_events(sock, 10)
-	for entry in adv_list:
-		data = entry.split(',')
-		if data[0].lower() == address.lower():
-			print(data[5])
-			rssi_list.append(int(data[5]))
+	for report in scanner.reports(timeout=1.0):
+		if report.address == packed_address:
+			print(report.rssi)
+			rssi_list.append(report.rssi)
 			if remaining > 0:
 				remaining -= 1
+				if remaining == 0:
+					break # Stop before the timeout, so exactly number_of_samples values are collected
 
+scanner.close()
+sock.close()
 
 print "Average: {} dBm, std {} over {} samples.".format(numpy.mean(rssi_list), numpy.std(rssi_list),  number_of_samples)
 